@@ -1,10 +1,9 @@
 import streamlit as st
 import pandas as pd
-from io import StringIO
+import numpy as np
 import re # Added for URL parsing
 import urllib.parse # Added for URL encoding sheet names
-from datetime import datetime
-from utils import add_currency_selector
+from utils import add_currency_selector, store_processed_data, get_data_fingerprint, unique_sorted, CATEGORICAL_COLUMNS, EMOJI_OPTIONS, EMOJI_INDEX
 # Removed display_global_date_filter import
 
 st.set_page_config(
@@ -118,19 +117,14 @@ def data_mapping_page():
         # Clear old processed data if new raw data is loaded
         if "processed_data" in st.session_state:
             del st.session_state.processed_data
+            st.session_state.pop("data_fingerprint", None)
+            st.session_state.pop("date_bounds", None)
         if "auto_processed" in st.session_state:
             del st.session_state.auto_processed
         st.rerun() # Rerun to start processing with the new data
 
     # --- START OF DATA PROCESSING (from st.session_state.raw_data) ---
     
-    # Ensure processed data has correct date type before filtering (FIX from previous TypeError)
-    if "processed_data" in st.session_state:
-        try:
-            st.session_state.processed_data['Date'] = pd.to_datetime(st.session_state.processed_data['Date'], errors='coerce')
-        except Exception:
-            pass # Handle cases where Date column might be missing post-edit
-
 
     if "raw_data" in st.session_state:
         raw_df = st.session_state.raw_data
@@ -168,7 +162,7 @@ def data_mapping_page():
                         # Auto-detect type based on amount (assuming positive=Income, negative=Expense)
                         # First, clean amount column
                         temp_amount = pd.to_numeric(raw_df[amount_col].astype(str).str.replace(r'[,"\$]', '', regex=True), errors='coerce')
-                        processed_df['Type'] = temp_amount.apply(lambda x: 'Income' if x >= 0 else 'Expense').fillna('Expense')
+                        processed_df['Type'] = np.where(temp_amount >= 0, 'Income', 'Expense') # NaN compares False, so unparsed amounts are 'Expense'
 
                     # Handle Account
                     processed_df['Account'] = raw_df[acct_col].fillna('Default Account') if acct_col else 'Default Account'
@@ -184,7 +178,7 @@ def data_mapping_page():
                     processed_df['Category'] = processed_df['Category'].astype(str).str.strip()
                     processed_df['Subcategory'] = processed_df['Subcategory'].astype(str).str.strip().fillna(processed_df['Category']) # New
                     
-                    st.session_state.processed_data = processed_df
+                    store_processed_data(processed_df)
                     st.session_state.invalid_rows = invalid_rows
                     st.session_state.auto_processed = True
                     st.rerun() # Rerun to show the results of auto-processing
@@ -272,7 +266,7 @@ def data_mapping_page():
                         
                         # Derive 'Type' if not provided
                         if 'Type' not in processed_df.columns:
-                            processed_df['Type'] = processed_df['Amount'].apply(lambda x: 'Income' if x >= 0 else 'Expense')
+                            processed_df['Type'] = np.where(processed_df['Amount'] >= 0, 'Income', 'Expense')
                         
                         # Set default 'Account' if not provided
                         if 'Account' not in processed_df.columns:
@@ -289,7 +283,7 @@ def data_mapping_page():
                         processed_df['Type'] = processed_df['Type'].fillna('Expense').astype(str)
                         processed_df['Account'] = processed_df['Account'].fillna('Default Account').astype(str)
                         
-                        st.session_state.processed_data = processed_df
+                        store_processed_data(processed_df)
                         st.session_state.auto_processed = True # Mark as processed
                         st.success(f"Successfully processed {len(processed_df)} out of {original_rows} valid rows. You can now explore the other pages or refine your data below.", icon="✅")
                         # st.balloons() # This was the line you had commented out, I'm keeping it commented.
@@ -308,9 +302,10 @@ def data_mapping_page():
             st.markdown("##### Filter Data Before Editing")
             st.info("Use these filters to find specific transactions you want to edit in the table below.", icon="💡")
             
-            all_categories_processed = ['All'] + sorted(st.session_state.processed_data['Category'].unique())
-            all_subcategories_processed = ['All'] + sorted(st.session_state.processed_data['Subcategory'].unique()) # New
-            all_types_processed = ['All'] + sorted(st.session_state.processed_data['Type'].unique())
+            # The categoricals' categories are already the sorted unique labels of the stored data
+            all_categories_processed = ['All'] + list(st.session_state.processed_data['Category'].cat.categories)
+            all_subcategories_processed = ['All'] + list(st.session_state.processed_data['Subcategory'].cat.categories) # New
+            all_types_processed = ['All'] + list(st.session_state.processed_data['Type'].cat.categories)
             
             edit_col1, edit_col2, edit_col3 = st.columns(3) # New layout
             with edit_col1:
@@ -320,8 +315,8 @@ def data_mapping_page():
             with edit_col3:
                 filter_type = st.selectbox("Filter by Type", options=all_types_processed)
             
-            # Apply filters
-            df_to_edit = st.session_state.processed_data.copy()
+            # Apply filters (on plain object columns, so new labels can be typed into the editor)
+            df_to_edit = st.session_state.processed_data.astype({col: 'object' for col in CATEGORICAL_COLUMNS})
             if filter_cat != 'All':
                 df_to_edit = df_to_edit[df_to_edit['Category'] == filter_cat]
             if filter_subcat != 'All': # New
@@ -339,8 +334,8 @@ def data_mapping_page():
                 column_config={
                     "Date": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
                     "Amount": st.column_config.NumberColumn("Amount", format=f"$ %.2f"),
-                    "Category": st.column_config.SelectboxColumn("Category", options=sorted(st.session_state.processed_data['Category'].unique()), required=True),
-                    "Subcategory": st.column_config.SelectboxColumn("Subcategory", options=sorted(st.session_state.processed_data['Subcategory'].unique()), required=True), # New
+                    "Category": st.column_config.SelectboxColumn("Category", options=all_categories_processed[1:], required=True),
+                    "Subcategory": st.column_config.SelectboxColumn("Subcategory", options=all_subcategories_processed[1:], required=True), # New
                     "Type": st.column_config.SelectboxColumn("Type", options=['Income', 'Expense', 'Stash'], required=True),
                     "Account": st.column_config.TextColumn("Account")
                 },
@@ -354,12 +349,14 @@ def data_mapping_page():
                     # The `edited_df` is the modified version of the *filtered* dataframe (`df_to_edit`).
                     # We must use .update() to apply these changes back to the *original* dataframe.
                     # Replacing the whole dataframe (as was done before) would delete all unfiltered data.
-                    st.session_state.processed_data.update(edited_df)
+                    # Categorical columns are updated as object so edited labels outside the categories are kept.
+                    updated_df = st.session_state.processed_data.astype({col: 'object' for col in CATEGORICAL_COLUMNS})
+                    updated_df.update(edited_df)
                     # --- END BUG FIX ---
                     
                     # Re-convert types just in case they were edited to invalid formats
-                    st.session_state.processed_data['Date'] = pd.to_datetime(st.session_state.processed_data['Date'], errors='coerce')
-                    st.session_state.processed_data['Amount'] = pd.to_numeric(st.session_state.processed_data['Amount'], errors='coerce')
+                    updated_df['Amount'] = pd.to_numeric(updated_df['Amount'], errors='coerce')
+                    store_processed_data(updated_df)
                     
                     st.success("Your changes have been saved!", icon="✅")
                     st.rerun()
@@ -377,17 +374,12 @@ def data_mapping_page():
                 st.session_state.stash_emojis = {}
 
             # Stashes are now defined by SUBCAREGORY
-            all_expense_subcategories = sorted(st.session_state.processed_data[
-                (st.session_state.processed_data['Type'] == 'Expense') | 
-                (st.session_state.processed_data['Type'] == 'Stash')
-            ]['Subcategory'].unique())
+            all_expense_subcategories = unique_sorted(st.session_state.processed_data, ('processed_data', get_data_fingerprint()), 'Subcategory', 'Type', ('Expense', 'Stash'))
 
             if not all_expense_subcategories:
                 st.info("No expense or stash subcategories found to define as stashes.")
                 return 
 
-            emoji_options = ["🏦", "💰", "✈️", "🚗", "🏠", "🎓", "🎁", "💻"]
-
             # --- New Default Logic (as requested) ---
             # 1. Auto-detect stashes based on name
             auto_detected_stashes = {
@@ -418,14 +410,17 @@ def data_mapping_page():
                     default=valid_default_stashes # Use new default logic
                 )
 
+            # Built into fresh dicts and stored with one assignment each, instead of clearing and
+            # writing the session_state dicts key by key
+            goals = {}
+            emojis = {}
+
             with col2:
                 st.markdown("**Set Your Goals**")
-                # Update session state keys based on selection
-                current_goals = st.session_state.stash_goals.copy()
-                st.session_state.stash_goals.clear() # Clear and rebuild
+                current_goals = st.session_state.stash_goals
                 
                 for stash in selected_stashes:
-                    st.session_state.stash_goals[stash] = st.number_input(
+                    goals[stash] = st.number_input(
                         f"Goal for {stash} ($)",
                         min_value=0.0,
                         value=current_goals.get(stash, 0.0),
@@ -434,16 +429,18 @@ def data_mapping_page():
             
             with col3:
                 st.markdown("**Assign Emojis**")
-                current_emojis = st.session_state.stash_emojis.copy()
-                st.session_state.stash_emojis.clear() # Clear and rebuild
+                current_emojis = st.session_state.stash_emojis
                 
                 for stash in selected_stashes:
-                    st.session_state.stash_emojis[stash] = st.selectbox(
+                    emojis[stash] = st.selectbox(
                         f"Emoji for {stash}",
-                        options=emoji_options,
-                        index=emoji_options.index(current_emojis.get(stash, "🏦")),
+                        options=EMOJI_OPTIONS,
+                        index=EMOJI_INDEX[current_emojis.get(stash, "🏦")],
                         key=f"emoji_{stash}"
                     )
+
+            st.session_state.stash_goals = goals
+            st.session_state.stash_emojis = emojis
             
             if st.button("Save Stash Definitions"):
                 st.success("Stash goals and emojis have been saved!", icon="✅")
@@ -453,7 +450,7 @@ def data_mapping_page():
         if "processed_data" in st.session_state and st.button("Clear All Data & Start Over"):
             # Removed global filter keys from here
             keys_to_clear = [
-                'raw_data', 'processed_data', 'auto_processed', 'invalid_rows', 
+                'raw_data', 'processed_data', 'data_fingerprint', 'date_bounds', 'auto_processed', 'invalid_rows', 
                 'stash_goals', 'stash_emojis', 'data_source_selector'
             ]
             for key in keys_to_clear:
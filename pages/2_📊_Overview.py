@@ -1,9 +1,8 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-import plotly.express as px # Still needed for colors
-from datetime import datetime, timedelta
-from utils import add_currency_selector ,display_global_date_filter
+import plotly.io as pio
+from utils import add_currency_selector ,display_global_date_filter, get_data_fingerprint, date_range_slice, isin_mask, unique_sorted, selection_filter, filter_rows, table_row_limit
 import numpy as np # Ensure numpy is imported
 
 st.set_page_config(
@@ -12,6 +11,39 @@ st.set_page_config(
     layout="wide"
 )
 
+# Columns sent to each transaction details table (the same set as the Expenses table)
+DETAIL_COLUMNS = ['Date', 'Amount', 'Category', 'Subcategory', 'Account', 'Type']
+
+def show_latest_transactions(df, mask, key, column_config):
+    """
+    Shows the rows of df where mask is set, newest first, projected to DETAIL_COLUMNS. Only the latest
+    rows are sent unless more are requested (see utils.table_row_limit). df is in date order
+    (see utils.prepare_processed_data), so the rows are picked without sorting.
+    """
+    positions = np.flatnonzero(mask)
+    rows_to_show = table_row_limit(len(positions), key)
+    details = df[DETAIL_COLUMNS].take(positions[::-1][:rows_to_show])
+    st.dataframe(details, use_container_width=True, hide_index=True, column_config=column_config)
+
+@st.cache_data(show_spinner=False)
+def _subcategory_pie_json(subcategory_totals, title):
+    """
+    Builds a subcategory donut chart from pre-aggregated totals and returns it as Plotly JSON.
+    """
+    fig_pie = go.Figure(data=[go.Pie(
+        labels=subcategory_totals.index,
+        values=subcategory_totals.values,
+        hole=.4,
+        pull=[0.05] * len(subcategory_totals.index),
+        textinfo="label+percent" # Add labels
+    )])
+    fig_pie.update_layout(
+        title_text=title,
+        height=400,
+        margin=dict(t=50, l=0, r=0, b=0)
+    )
+    return fig_pie.to_json()
+
 def overview_page():
     """
     This page provides a high-level overview of the user's finances.
@@ -28,15 +60,16 @@ def overview_page():
         st.page_link("pages/1_📑_Data_Mapping.py", label="Go to Data Mapping", icon="🗺️")
         return
     
+    # Date is already datetime64 (converted once in utils.store_processed_data)
     df = st.session_state.processed_data
-    # Ensure Date column is in datetime format
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-
-    if st.session_state.get("global_start_date") is not None and st.session_state.get("global_end_date") is not None:
-        start_date = st.session_state.get("global_start_date")
-        end_date = st.session_state.get("global_end_date")
-        date_mask = (df['Date'].dt.date >= start_date) & (df['Date'].dt.date <= end_date)
-        df = df[date_mask]
+
+    start_date = st.session_state.get("global_start_date")
+    end_date = st.session_state.get("global_end_date")
+    if start_date is not None and end_date is not None:
+        df = date_range_slice(df, start_date, end_date)
+    # Identifies df for the cached filter options; tagged with the page because
+    # unique_sorted's cache is shared with the other pages
+    df_key = ('overview', get_data_fingerprint(), start_date, end_date)
         
     # --- Data Filtering ---
     st.header("🗓️ Select Your Filters")
@@ -48,30 +81,29 @@ def overview_page():
         # --- New Cascading Filters ---
         with col2:
             # --- Account Filtering ---
-            all_accounts = sorted(df['Account'].unique())
+            all_accounts = unique_sorted(df, df_key, 'Account')
             selected_accounts = st.multiselect("Filter by Account(s)", options=all_accounts, default=all_accounts)
             
             # --- Category Filtering ---
-            all_categories = sorted(df['Category'].unique())
+            all_categories = unique_sorted(df, df_key, 'Category')
             selected_categories = st.multiselect("Filter by Category(s)", options=all_categories, default=all_categories)
 
         with col3:
             # --- Subcategory Filtering (Dynamic) ---
             if not selected_categories:
-                available_subcategories = sorted(df['Subcategory'].unique())
+                available_subcategories = unique_sorted(df, df_key, 'Subcategory')
             else:
-                available_subcategories = sorted(df[df['Category'].isin(selected_categories)]['Subcategory'].unique())
+                available_subcategories = unique_sorted(df, df_key, 'Subcategory', 'Category', tuple(selected_categories))
             
             selected_subcategories = st.multiselect("Filter by Subcategory(s)", options=available_subcategories, default=available_subcategories)
 
 
-    # Apply all filters
-    date_mask = (df['Date'].dt.date >= start_date) & (df['Date'].dt.date <= end_date)
-    account_mask = df['Account'].isin(selected_accounts)
-    category_mask = df['Category'].isin(selected_categories)
-    subcategory_mask = df['Subcategory'].isin(selected_subcategories) # New mask
-
-    filtered_df = df[date_mask & account_mask & category_mask & subcategory_mask] # Updated filter application
+    # Apply all filters (df is already limited to the global date range); filters with every option selected are skipped
+    filtered_df = filter_rows(df, {
+        'Account': selection_filter(selected_accounts, all_accounts),
+        'Category': selection_filter(selected_categories, all_categories),
+        'Subcategory': selection_filter(selected_subcategories, available_subcategories)
+    })
 
 
     if filtered_df.empty:
@@ -86,16 +118,19 @@ def overview_page():
     # A transaction is a "Stash" if:
     # 1. Its Type is explicitly 'Stash'
     # 2. Its Type is 'Expense' AND its Subcategory is in the defined stash list
-    stash_mask = (filtered_df['Type'] == 'Stash') | \
-                 ((filtered_df['Type'] == 'Expense') & (filtered_df['Subcategory'].isin(stash_subcategories)))
+    # Type and Subcategory are categoricals, so these masks compare int codes
+    is_expense = isin_mask(filtered_df['Type'], ['Expense'])
+    # Built in place on one array instead of allocating a temporary per operator
+    stash_mask = is_expense & isin_mask(filtered_df['Subcategory'], stash_subcategories)
+    stash_mask |= isin_mask(filtered_df['Type'], ['Stash'])
     
     # New Expense Mask:
     # An "Expense" is:
     # 1. Its Type is 'Expense'
     # 2. AND it is NOT a stash (as defined above)
-    expense_mask = (filtered_df['Type'] == 'Expense') & (~stash_mask)
+    expense_mask = is_expense & ~stash_mask
     
-    income_mask = filtered_df['Type'] == 'Income'
+    income_mask = isin_mask(filtered_df['Type'], ['Income'])
 
     # --- High-Level KPIs ---
     st.markdown("---")
@@ -132,32 +167,15 @@ def overview_page():
     st.header("📊 Cumulative Financials Over Time")
     st.markdown("How are you trending? 📉 This chart shows your financial journey over time, tracking how your savings grow (or shrink!).")
     
-    # Make a copy to avoid changing the original filtered_df and sort by date
-    time_series_df = filtered_df.copy().sort_values('Date')
-    
-    # Get stash subcategories again for this dataframe
-    stash_subcategories_ts = st.session_state.get('stash_goals', {}).keys()
-    
-    # Create separate income, expense, and stash columns for cumulative calculation
-    def get_type(row):
-        if row['Type'] == 'Income':
-            return 'Income'
-        if row['Type'] == 'Stash' or (row['Type'] == 'Expense' and row['Subcategory'] in stash_subcategories_ts):
-            return 'Stash'
-        if row['Type'] == 'Expense':
-            return 'Expense'
-        return 'Other'
-
-    time_series_df['Tx_Type'] = time_series_df.apply(get_type, axis=1)
-    
-    time_series_df['Income'] = time_series_df.apply(lambda row: row['Amount'] if row['Tx_Type'] == 'Income' else 0, axis=1)
-    time_series_df['Expense'] = time_series_df.apply(lambda row: row['Amount'] if row['Tx_Type'] == 'Expense' else 0, axis=1)
-    time_series_df['Stash'] = time_series_df.apply(lambda row: row['Amount'] if row['Tx_Type'] == 'Stash' else 0, axis=1) # New
-
-    # Calculate cumulative sums
-    time_series_df['Cumulative Income'] = time_series_df['Income'].cumsum()
-    time_series_df['Cumulative Expense'] = time_series_df['Expense'].cumsum()
-    time_series_df['Cumulative Stash'] = time_series_df['Stash'].cumsum() # New
+    # filtered_df is already in date order (utils.prepare_processed_data sorts processed_data),
+    # and the KPI masks above already split the rows into income, expense and stash
+    amounts = filtered_df['Amount'].to_numpy()
+    time_series_df = pd.DataFrame({
+        'Date': filtered_df['Date'].to_numpy(),
+        'Cumulative Income': np.where(income_mask, amounts, 0).cumsum(),
+        'Cumulative Expense': np.where(expense_mask, amounts, 0).cumsum(),
+        'Cumulative Stash': np.where(stash_mask, amounts, 0).cumsum() # New
+    })
     # --- CALCULATION UPDATED AS REQUESTED ---
     time_series_df['Cumulative Total Savings'] = time_series_df['Cumulative Income'] + time_series_df['Cumulative Stash'] - time_series_df['Cumulative Expense']
 
@@ -240,70 +258,37 @@ def overview_page():
 
     with vis1:
         st.subheader("💰 Income Sources")
-        income_df = filtered_df[income_mask].copy()
+        income_df = filtered_df[income_mask] # Only read below, so no defensive copy
         if income_df.empty:
             st.info("No income data to display.")
         else:
             # Group by Subcategory
-            subcategory_income = income_df.groupby('Subcategory')['Amount'].sum().sort_values(ascending=False)
-            fig_pie_income = go.Figure(data=[go.Pie(
-                labels=subcategory_income.index,
-                values=subcategory_income.values,
-                hole=.4,
-                pull=[0.05] * len(subcategory_income.index),
-                textinfo="label+percent" # Add labels
-            )])
-            fig_pie_income.update_layout(
-                title_text='Income Breakdown by Subcategory',
-                height=400,
-                margin=dict(t=50, l=0, r=0, b=0)
-            )
-            st.plotly_chart(fig_pie_income, use_container_width=True)
+            subcategory_income = income_df.groupby('Subcategory', observed=True)['Amount'].sum().sort_values(ascending=False)
+            fig_pie_income = _subcategory_pie_json(subcategory_income, 'Income Breakdown by Subcategory')
+            st.plotly_chart(pio.from_json(fig_pie_income), use_container_width=True)
 
 
     with vis2:
         st.subheader("💸 Expense Breakdown")
-        expense_df = filtered_df[expense_mask].copy()
+        expense_df = filtered_df[expense_mask] # Only read below, so no defensive copy
         if expense_df.empty:
             st.info("No expense data to display.")
         else:
             # Group by Subcategory
-            subcategory_expense = expense_df.groupby('Subcategory')['Amount'].sum().sort_values(ascending=False)
-            fig_pie_expense = go.Figure(data=[go.Pie(
-                labels=subcategory_expense.index,
-                values=subcategory_expense.values,
-                hole=.4,
-                pull=[0.05] * len(subcategory_expense.index),
-                textinfo="label+percent" # Add labels
-            )])
-            fig_pie_expense.update_layout(
-                title_text='Expense Breakdown by Subcategory',
-                height=400,
-                margin=dict(t=50, l=0, r=0, b=0)
-            )
-            st.plotly_chart(fig_pie_expense, use_container_width=True)
+            subcategory_expense = expense_df.groupby('Subcategory', observed=True)['Amount'].sum().sort_values(ascending=False)
+            fig_pie_expense = _subcategory_pie_json(subcategory_expense, 'Expense Breakdown by Subcategory')
+            st.plotly_chart(pio.from_json(fig_pie_expense), use_container_width=True)
 
     with vis3:
         st.subheader("🏦 Stash Breakdown")
-        stash_df = filtered_df[stash_mask].copy()
+        stash_df = filtered_df[stash_mask] # Only read below, so no defensive copy
         if stash_df.empty:
             st.info("No stash data to display.")
         else:
             # Group by Subcategory
-            subcategory_stash = stash_df.groupby('Subcategory')['Amount'].sum().sort_values(ascending=False)
-            fig_pie_stash = go.Figure(data=[go.Pie(
-                labels=subcategory_stash.index,
-                values=subcategory_stash.values,
-                hole=.4,
-                pull=[0.05] * len(subcategory_stash.index),
-                textinfo="label+percent" # Add labels
-            )])
-            fig_pie_stash.update_layout(
-                title_text='Stash Breakdown by Subcategory',
-                height=400,
-                margin=dict(t=50, l=0, r=0, b=0)
-            )
-            st.plotly_chart(fig_pie_stash, use_container_width=True)
+            subcategory_stash = stash_df.groupby('Subcategory', observed=True)['Amount'].sum().sort_values(ascending=False)
+            fig_pie_stash = _subcategory_pie_json(subcategory_stash, 'Stash Breakdown by Subcategory')
+            st.plotly_chart(pio.from_json(fig_pie_stash), use_container_width=True)
 
     # --- Detailed Transactions ---
     st.markdown("---")
@@ -311,21 +296,23 @@ def overview_page():
     st.markdown("Want to see the fine print? 📝 Here are all the individual transactions for the period, split by type.")
 
     trans1, trans2, trans3 = st.columns(3) # Updated to 3 columns
+    # Streamlit formats Date and Amount on render, as on the other pages, so the columns stay numeric
+    details_column_config = {
+        "Date": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
+        "Amount": st.column_config.NumberColumn("Amount", format=f"{currency_symbol}%.2f")
+    }
 
     with trans1:
         with st.expander("💸 Expenses in Period"):
-            expense_details = filtered_df[expense_mask].sort_values('Date', ascending=False)
-            st.dataframe(expense_details, use_container_width=True, hide_index=True)
+            show_latest_transactions(filtered_df, expense_mask, "overview_expense_details", details_column_config)
 
     with trans2:
         with st.expander("💰 Incomes in Period"):
-            income_details = filtered_df[income_mask].sort_values('Date', ascending=False)
-            st.dataframe(income_details, use_container_width=True, hide_index=True)
+            show_latest_transactions(filtered_df, income_mask, "overview_income_details", details_column_config)
             
     with trans3:
         with st.expander("🏦 Stashes in Period"):
-            stash_details = filtered_df[stash_mask].sort_values('Date', ascending=False)
-            st.dataframe(stash_details, use_container_width=True, hide_index=True)
+            show_latest_transactions(filtered_df, stash_mask, "overview_stash_details", details_column_config)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,8 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
 import plotly.express as px
-from datetime import datetime
-from utils import add_currency_selector, display_global_date_filter
-from dateutil.relativedelta import relativedelta
-import calendar
+import plotly.io as pio
+from utils import add_currency_selector, display_global_date_filter, get_data_fingerprint, date_range_slice, get_color_map, percent_change, isin_mask, unique_sorted, selection_filter, filter_rows, year_month_keys, year_month_starts, monthly_totals, table_row_limit
 import numpy as np
 
 st.set_page_config(
@@ -14,36 +11,289 @@ st.set_page_config(
     layout="wide"
 )
 
-def format_currency(amount, currency_symbol):
-    """Formats a number as currency."""
-    return f"{currency_symbol}{amount:,.2f}"
+# Groups drawn individually in the spending timeline; the rest are folded into one 'Other (n more)' group
+TIMELINE_MAX_GROUPS = 10
+TIMELINE_LABELS = {'D': 'Daily', 'W': 'Weekly', 'MS': 'Monthly'}
 
-def calculate_ytd_average(df, group_col, item_name, selected_month_start):
+# --- Cached computations ---
+# Arguments starting with an underscore are not hashed by Streamlit; each helper
+# takes a small key (data fingerprint + filter selections) that identifies them instead.
+
+@st.cache_data(show_spinner=False)
+def _prepare_expenses(_processed_data, data_fingerprint, start_date, end_date, stash_subcategories):
     """
-    Calculates the YTD monthly average for a specific category/subcategory,
-    excluding the selected month.
+    Returns the true expense transactions (Type 'Expense' and not a stash)
+    within the global date range, with Amount stored in a compact dtype.
+    The label columns are already categoricals (see utils.prepare_processed_data).
     """
-    # FIX: Compare date objects (.dt.date) to date objects (selected_month_start)
-    ytd_df = df[
-        (df['Date'].dt.date < selected_month_start) &
-        (df['Date'].dt.date >= selected_month_start.replace(month=1, day=1)) &
-        (df[group_col] == item_name)
-    ]
-    
-    if ytd_df.empty:
-        return 0.0
+    # Filter by global date first
+    df = date_range_slice(_processed_data, start_date, end_date)
+
+    # Correct Expense Mask: Type is 'Expense' AND Subcategory is NOT in the stash list
+    expense_mask = isin_mask(df['Type'], ['Expense'])
+    expense_mask &= ~isin_mask(df['Subcategory'], stash_subcategories)
+    df_expenses = df.take(np.flatnonzero(expense_mask))
+
+    # Currency amounts fit in float32; keep float64 if downcasting would shift any value by a cent
+    amount_32 = df_expenses['Amount'].astype('float32')
+    if (df_expenses['Amount'] - amount_32.astype('float64')).abs().max() < 0.005:
+        df_expenses['Amount'] = amount_32
+
+    # Calendar keys for the trend groupbys: day, weekday, week of month, months since year 0
+    dates = df_expenses['Date'].dt
+    df_expenses['_day'] = dates.normalize()
+    df_expenses['_wd'] = dates.weekday.astype('int8')
+    df_expenses['_wom'] = ((dates.day - 1) // 7 + 1).astype('int8')
+    df_expenses['_yearmonth'] = year_month_keys(df_expenses['Date'])
+
+    return df_expenses
+
+@st.cache_data(show_spinner=False)
+def _filter_expenses(_df_expenses, expenses_key, accounts, categories, subcategories):
+    """
+    Applies the Account, Category and Subcategory filters to the expense frame.
+    """
+    return filter_rows(_df_expenses, {'Account': accounts, 'Category': categories, 'Subcategory': subcategories})
+
+def with_float64_amount(df):
+    """
+    Returns df with Amount as float64 for summing. The stored float32 values are exact to the cent,
+    but float32 totals are not (a multi-million sum lands on a 0.5 step). Under copy-on-write only
+    the Amount column is new.
+    """
+    return df.assign(Amount=df['Amount'].astype('float64'))
+
+def timeline_freq(dates):
+    """
+    Picks the bar width for the spending timeline: days for under ~6 months,
+    weeks for under 2 years, months beyond that.
+    """
+    n_days = (dates.max() - dates.min()).days + 1
+    if n_days < 180:
+        return 'D'
+    if n_days < 730:
+        return 'W'
+    return 'MS'
+
+def spend_by_period(df, group_col, period):
+    """
+    Sums spending per period bucket and group for the trend tabs.
+    period is a timeline frequency ('D', 'W' or 'MS'), 'weekday', 'week_of_month' or 'month'.
+    """
+    # Group on datetime64 bins and small ints rather than Python dates and day-name strings
+    if period in TIMELINE_LABELS:
+        timeline = df.groupby([pd.Grouper(key='Date', freq=period), group_col], observed=True)['Amount'].sum().reset_index()
+        # Keep the biggest groups and fold the long tail into one group so the chart stays readable;
+        # the label carries the count so it can't merge with a real group called 'Other'
+        group_totals = timeline.groupby(group_col, observed=True)['Amount'].sum()
+        if len(group_totals) > TIMELINE_MAX_GROUPS:
+            top_groups = group_totals.nlargest(TIMELINE_MAX_GROUPS).index
+            other_label = f"Other ({len(group_totals) - TIMELINE_MAX_GROUPS} more)"
+            labels = timeline[group_col].astype('object').where(timeline[group_col].isin(top_groups), other_label)
+            timeline = timeline.groupby(['Date', labels])['Amount'].sum().reset_index()
+        return timeline.rename(columns={'Date': 'Date_str'})
+
+    if period == 'weekday':
+        weekday_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+        spend_by_weekday = df.groupby(['_wd', group_col], observed=True)['Amount'].sum().reset_index()
+        # Map the day numbers to names once, on the aggregated rows
+        spend_by_weekday.insert(0, 'weekday', pd.Categorical.from_codes(spend_by_weekday.pop('_wd'), categories=weekday_order, ordered=True))
+        return spend_by_weekday
+
+    if period == 'week_of_month':
+        return df.groupby(['_wom', group_col], observed=True)['Amount'].sum().reset_index().rename(columns={'_wom': 'week_of_month'})
+
+    # The int month key sorts chronologically, so the groupby's own sort gives the chart order
+    spend_by_month = df.groupby(['_yearmonth', group_col], observed=True)['Amount'].sum().reset_index()
+    month_starts = year_month_starts(spend_by_month.pop('_yearmonth'))
+    spend_by_month.insert(0, 'Date', month_starts)
+    spend_by_month['month_str'] = month_starts.strftime('%B %Y')
+    return spend_by_month
+
+@st.cache_data(show_spinner=False)
+def _trend_aggregations(_filtered_df, filter_key, group_col, timeline_bucket):
+    """
+    Computes the spending totals for all four trend tabs in one cached call,
+    so switching tabs or touching unrelated widgets doesn't redo any groupby.
+    """
+    # The calendar-key groupbys below sum in float64 (see with_float64_amount)
+    _filtered_df = with_float64_amount(_filtered_df)
+    return {
+        'timeline': spend_by_period(_filtered_df, group_col, timeline_bucket),
+        'weekday': spend_by_period(_filtered_df, group_col, 'weekday'),
+        'week_of_month': spend_by_period(_filtered_df, group_col, 'week_of_month'),
+        'month': spend_by_period(_filtered_df, group_col, 'month')
+    }
+
+@st.cache_data(show_spinner=False)
+def _available_months(_filtered_df, filter_key):
+    """
+    Returns the months with expenses as {display label: Period}, newest first.
+    """
+    year_months = np.unique(_filtered_df['_yearmonth'].to_numpy())[::-1]
+    months = year_month_starts(year_months).to_period('M')
+    return dict(zip(months.strftime('%B %Y'), months))
+
+@st.cache_data(show_spinner=False)
+def _expense_insights(_filtered_df, _df_expenses, filter_key, group_col, selected_ym):
+    """
+    Builds the insight table for the selected month: this month from the filtered
+    expenses, last month and the YTD average from all expenses in the global date range.
+    """
+    this_month_df = with_float64_amount(_filtered_df[_filtered_df['_yearmonth'] == selected_ym])
+    last_month_df = with_float64_amount(_df_expenses[_df_expenses['_yearmonth'] == selected_ym - 1])
+    comparison = month_comparison(this_month_df, last_month_df, group_col)
+    monthly = _monthly_spend(_df_expenses, filter_key[0], group_col) # filter_key[0] is the expenses key
+    ytd_avg = calculate_ytd_average(monthly, selected_ym).reindex(comparison.index, fill_value=0.0)
+    return build_insights_table(comparison, group_col, ytd_avg)
+
+@st.cache_data(show_spinner=False)
+def _treemap_summary(_filtered_df, filter_key):
+    """
+    Rolls spending up to one row per Category/Subcategory for the treemap.
+    """
+    # Roll up to one row per Category/Subcategory so Plotly doesn't receive every transaction
+    # Missing labels are already 'Uncategorized' (see utils.prepare_processed_data), so there are no NaN paths
+    return with_float64_amount(_filtered_df).groupby(['Category', 'Subcategory'], observed=True, as_index=False)['Amount'].sum()
+
+@st.cache_data(show_spinner=False)
+def _habit_summary(_filtered_df, filter_key, habit_granularity):
+    """
+    Aggregates total spend, frequency, average spend and last purchase per group.
+    """
+    grouped_habits = with_float64_amount(_filtered_df).groupby(habit_granularity, observed=True).agg(
+        Total_Spend=('Amount', 'sum'),
+        Frequency=('Amount', 'size'),
+        Most_Recent=('Date', 'max')
+    ).reset_index()
+    # Average is derived from the small grouped frame instead of another pass over Amount
+    grouped_habits.insert(3, 'Avg_Spend', grouped_habits['Total_Spend'] / grouped_habits['Frequency'])
+    return grouped_habits
+
+@st.cache_data(show_spinner=False)
+def _monthly_spend(_df_expenses, expenses_key, group_col):
+    """
+    Returns spending per month and group in one pass: a frame indexed by the int
+    year-month key with 'total' and 'count' column blocks, one column per group.
+    """
+    return monthly_totals(_df_expenses, group_col)
+
+def calculate_ytd_average(monthly, selected_ym):
+    """
+    Calculates the YTD monthly average per category/subcategory, excluding the selected month
+    and counting only months with spending.
+    """
+    ytd = monthly[(monthly.index >= selected_ym - selected_ym % 12) & (monthly.index < selected_ym)]
 
     # Find number of months with spending
-    months_with_spending = ytd_df['Date'].dt.to_period('M').nunique()
-    if months_with_spending == 0:
-        return 0.0
-        
-    ytd_total = ytd_df['Amount'].sum()
-    return ytd_total / months_with_spending
+    months_with_spending = (ytd['count'] > 0).sum()
+    ytd_total = ytd['total'].sum()
+    return (ytd_total / months_with_spending.where(months_with_spending > 0)).fillna(0.0)
+
+def month_comparison(this_month_df, last_month_df, group_col):
+    """
+    Sums this month's and last month's spending per group in a single groupby.
+    Returns a frame indexed by group with 'This Month' and 'Last Month' columns (0 where absent).
+    """
+    window = pd.concat([
+        this_month_df[[group_col, 'Amount']].assign(_month='This Month'),
+        last_month_df[[group_col, 'Amount']].assign(_month='Last Month')
+    ])
+    comparison = window.groupby([group_col, '_month'], observed=True)['Amount'].sum().unstack('_month', fill_value=0)
+    return comparison.reindex(columns=['This Month', 'Last Month'], fill_value=0)
+
+# --- Cached figures ---
+# Figures are built from the small aggregated frames and cached as Plotly JSON, so reruns
+# that don't change the chart inputs skip Plotly Express' trace construction and validation.
+
+@st.cache_data(show_spinner=False)
+def _stacked_bar_json(data, x, group_col, x_label, title, color_map, currency_symbol, layout=None, xaxes=None):
+    """
+    Builds a stacked bar chart of Amount per x and group and returns it as Plotly JSON.
+    """
+    fig = px.bar(data, x=x, y='Amount', color=group_col, labels={'Amount': 'Total Spend', x: x_label},
+                 color_discrete_map=color_map, title=title)
+    if xaxes:
+        fig.update_xaxes(**xaxes)
+    fig.update_layout(xaxis_title=x_label, yaxis_title=f'Amount ({currency_symbol})', height=400, barmode='stack', **(layout or {}))
+    return fig.to_json()
+
+@st.cache_data(show_spinner=False)
+def _treemap_json(treemap_df, currency_symbol):
+    """
+    Builds the Category/Subcategory treemap and returns it as Plotly JSON.
+    """
+    fig_treemap = px.treemap(
+        treemap_df,
+        path=[px.Constant("All Expenses"), 'Category', 'Subcategory'], # Hierarchical path
+        values='Amount',
+        color='Amount',
+        color_continuous_scale='Reds',
+        hover_data={'Amount': f':.2f'}
+    )
+    fig_treemap.update_layout(
+        title_text='Expense Breakdown by Category & Subcategory',
+        margin=dict(t=50, l=25, r=25, b=25)
+    )
+    fig_treemap.update_traces(
+        hovertemplate='<b>%{label}</b><br>Total Spend: ' + currency_symbol + '%{value:,.2f}<br>Percentage of Parent: %{percentParent:.1%}'
+    )
+    return fig_treemap.to_json()
+
+@st.cache_data(show_spinner=False)
+def _bubble_json(grouped_habits, habit_granularity, currency_symbol):
+    """
+    Builds the frequency vs. average spend bubble chart and returns it as Plotly JSON.
+    """
+    fig_bubble = px.scatter(
+        grouped_habits,
+        x="Frequency",
+        y="Avg_Spend",
+        size="Total_Spend",
+        color=habit_granularity,
+        hover_name=habit_granularity,
+        size_max=60,
+        log_x=True,
+        log_y=True,
+        render_mode='webgl',
+        title=f"Spending Habits by {habit_granularity}"
+    )
+    fig_bubble.update_layout(
+        xaxis_title="Frequency (Number of Transactions)",
+        yaxis_title=f"Average Spend ({currency_symbol})",
+        height=500
+    )
+    fig_bubble.update_traces(
+        hovertemplate=(
+            f'<b>%{{hovertext}}</b><br>' +
+            'Frequency: %{x}<br>' +
+            f'Avg. Spend: {currency_symbol}%{{y:,.2f}}<br>' +
+            f'Total Spend: {currency_symbol}%{{marker.size:,.2f}}'
+        )
+    )
+    return fig_bubble.to_json()
+
+def build_insights_table(comparison, group_col, ytd_avg):
+    """
+    Builds the insight table from a month_comparison frame and the matching YTD averages,
+    working on whole columns instead of appending one dict per group.
+    """
+    this_month = comparison['This Month'].to_numpy(dtype='float64')
+    last_month = comparison['Last Month'].to_numpy(dtype='float64')
+    ytd_avg = np.asarray(ytd_avg, dtype='float64')
+
+    insights_df = pd.DataFrame({
+        group_col: comparison.index,
+        "This Month": this_month,
+        "Last Month": last_month,
+        "vs. Last Month (%)": percent_change(this_month, last_month),
+        "vs. YTD Avg (%)": percent_change(this_month, ytd_avg)
+    })
+    return insights_df.sort_values(by=["vs. Last Month (%)","vs. YTD Avg (%)"])
 
 def build_trend_metrics(df, group_col, period_col_name):
     metrics_df = (
-        df.groupby(group_col)
+        with_float64_amount(df).groupby(group_col, observed=True)
         .agg(
             Total_Spend=('Amount', 'sum'),
             Transactions=('Amount', 'count'),
@@ -53,17 +303,15 @@ def build_trend_metrics(df, group_col, period_col_name):
         .reset_index()
     )
 
-    metrics_df['Avg_Period_Spend'] = metrics_df.apply(
-        lambda row: row['Total_Spend'] / row['Periods'] if row['Periods'] > 0 else 0,
-        axis=1
-    )
+    periods = metrics_df['Periods'].to_numpy()
+    metrics_df['Avg_Period_Spend'] = np.where(periods > 0, metrics_df['Total_Spend'].to_numpy() / np.maximum(periods, 1), 0)
 
     return metrics_df.sort_values('Avg_Period_Spend', ascending=False)
 
 def render_trend_summary_cards(
     metrics_df,
     group_col,
-    currency_symbol,
+    fmt_money,
     avg_label="Avg Spend",
     cards_per_row=2):
 
@@ -71,14 +319,21 @@ def render_trend_summary_cards(
         st.info("No summary metrics to display.")
         return
 
-    for start_idx in range(0, len(metrics_df), cards_per_row):
-        row_slice = metrics_df.iloc[start_idx:start_idx + cards_per_row]
+    # Read the columns out as arrays once instead of building a Series per row with iterrows
+    cards = list(zip(
+        metrics_df[group_col].to_numpy(),
+        metrics_df['Avg_Period_Spend'].to_numpy(),
+        metrics_df['Transactions'].to_numpy(),
+        metrics_df['Max_Amount'].to_numpy()
+    ))
+
+    for start_idx in range(0, len(cards), cards_per_row):
         cols = st.columns(cards_per_row)
 
-        for col, (_, row) in zip(cols, row_slice.iterrows()):
+        for col, (group, avg_spend, transactions, max_amount) in zip(cols, cards[start_idx:start_idx + cards_per_row]):
             with col:
                 with st.container(border=True):
-                    st.markdown(f"### {row[group_col]}")
+                    st.markdown(f"### {group}")
                     # st.caption("Amount")
 
                     m1, m2, m3 = st.columns(3)
@@ -86,19 +341,19 @@ def render_trend_summary_cards(
                     with m1:
                         st.metric(
                             avg_label,
-                            f"{currency_symbol}{row['Avg_Period_Spend']:,.2f}"
+                            fmt_money(avg_spend)
                         )
 
                     with m2:
                         st.metric(
                             "Transactions",
-                            f"{int(row['Transactions'])}"
+                            f"{int(transactions)}"
                         )
 
                     with m3:
                         st.metric(
                             "Max Transaction",
-                            f"{currency_symbol}{row['Max_Amount']:,.2f}"
+                            fmt_money(max_amount)
                         )
 
 def expenses_page():
@@ -107,6 +362,8 @@ def expenses_page():
     """
     add_currency_selector()
     currency_symbol = st.session_state.get("currency_symbol", "$")
+    # Bound once per run and reused for every KPI and card value
+    fmt_money = (currency_symbol + "{:,.2f}").format
     
     st.title("💸 Expense Deep Dive")
     st.markdown("Let's take a closer look at where your money is going. Use the tools on this page to analyze your spending habits.")
@@ -116,9 +373,6 @@ def expenses_page():
         st.page_link("pages/1_📑_Data_Mapping.py", label="Go to Data Mapping", icon="🗺️")
         return
 
-    df = st.session_state.processed_data.copy()
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-
     # --- Global Date Filter ---
     display_global_date_filter()
     if st.session_state.get("global_start_date") is None:
@@ -127,19 +381,11 @@ def expenses_page():
         
     start_date = st.session_state.global_start_date
     end_date = st.session_state.global_end_date
-    
-    # Filter by global date first
-    date_mask = (df['Date'].dt.date >= start_date) & (df['Date'].dt.date <= end_date)
-    df = df[date_mask]
 
     # --- Stash/Expense Logic ---
-    stash_subcategories = st.session_state.get('stash_goals', {}).keys()
-    
-    # Correct Expense Mask: Type is 'Expense' AND Subcategory is NOT in the stash list
-    expense_mask = (df['Type'] == 'Expense') & (~df['Subcategory'].isin(stash_subcategories))
-    
-    # Apply the mask to get only true expenses
-    df_expenses = df[expense_mask].copy()
+    stash_subcategories = tuple(sorted(st.session_state.get('stash_goals', {}).keys()))
+    expenses_key = (get_data_fingerprint(), start_date, end_date, stash_subcategories)
+    df_expenses = _prepare_expenses(st.session_state.processed_data, *expenses_key)
 
     # --- Data Filtering (Account, Category, Subcategory) ---
     st.header("🗓️ Select Your Filters")
@@ -149,27 +395,24 @@ def expenses_page():
         col1, col2, col3 = st.columns(3)
 
         with col1:
-            all_accounts = sorted(df_expenses['Account'].unique())
+            all_accounts = unique_sorted(df_expenses, expenses_key, 'Account')
             selected_accounts = st.multiselect("Filter by Account(s)", options=all_accounts, default=all_accounts)
 
         with col2:
-            all_categories = sorted(df_expenses['Category'].unique())
+            all_categories = unique_sorted(df_expenses, expenses_key, 'Category')
             selected_categories = st.multiselect("Filter by Category(s)", options=all_categories, default=all_categories)
 
         with col3:
-            if not selected_categories:
-                available_subcategories = sorted(df_expenses['Subcategory'].unique())
-            else:
-                available_subcategories = sorted(df_expenses[df_expenses['Category'].isin(selected_categories)]['Subcategory'].unique())
-            
+            # An empty category selection falls back to all subcategories
+            available_subcategories = unique_sorted(df_expenses, expenses_key, 'Subcategory', 'Category', tuple(selected_categories))
+
             selected_subcategories = st.multiselect("Filter by Subcategory(s)", options=available_subcategories, default=available_subcategories)
 
     # Apply all filters
-    account_mask = df_expenses['Account'].isin(selected_accounts)
-    category_mask = df_expenses['Category'].isin(selected_categories)
-    subcategory_mask = df_expenses['Subcategory'].isin(selected_subcategories)
-
-    filtered_df = df_expenses[account_mask & category_mask & subcategory_mask]
+    # Filters with every option selected are passed as None and skipped
+    filter_key = (expenses_key, selection_filter(selected_accounts, all_accounts), selection_filter(selected_categories, all_categories),
+                  selection_filter(selected_subcategories, available_subcategories))
+    filtered_df = _filter_expenses(df_expenses, *filter_key)
 
     if filtered_df.empty:
         st.info("No expense transactions found for the selected filters. Looks like you're saving money!", icon="🎉")
@@ -180,17 +423,18 @@ def expenses_page():
     st.header("📈 Expense Metrics")
     st.markdown("Here are the key numbers for your spending in this period.")
 
-    total_expenses = filtered_df['Amount'].sum()
+    # Accumulate in float64 so the float32 Amount column doesn't drift the headline total
+    total_expenses = float(filtered_df['Amount'].to_numpy().sum(dtype='float64'))
     num_transactions = len(filtered_df)
     largest_expense = filtered_df['Amount'].max()
     num_days = (end_date - start_date).days + 1
     avg_daily_spend = total_expenses / num_days if num_days > 0 else 0
 
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-    kpi1.metric("Total Expenses", format_currency(total_expenses, currency_symbol),border=True)
+    kpi1.metric("Total Expenses", fmt_money(total_expenses),border=True)
     kpi2.metric("Number of Transactions", f"{num_transactions}",border=True)
-    kpi3.metric("Average Daily Spend", format_currency(avg_daily_spend, currency_symbol),border=True)
-    kpi4.metric("Largest Single Expense", format_currency(largest_expense, currency_symbol),border=True)
+    kpi3.metric("Average Daily Spend", fmt_money(avg_daily_spend),border=True)
+    kpi4.metric("Largest Single Expense", fmt_money(largest_expense),border=True)
 
     # --- Automated Insights ---
     st.markdown("---")
@@ -198,30 +442,22 @@ def expenses_page():
     st.markdown("Get a quick analysis of your spending habits. How does this month compare to the last, or to your yearly average?")
 
     # Get all unique months from the filtered data for the selector
-    available_months = sorted(filtered_df['Date'].dt.to_period('M').unique(), reverse=True)
+    # Format months for display (e.g., "October 2025")
+    available_months = _available_months(filtered_df, filter_key)
     if not available_months:
         st.info("Not enough data to generate insights.")
         # We 'return' here because the rest of the page depends on this check
         st.stop() # Use st.stop() to halt execution gracefully if no months
 
-    # Format months for display (e.g., "October 2025")
-    month_display_options = [month.strftime('%B %Y') for month in available_months]
-    selected_month_str = st.selectbox("Select a month to analyze", options=month_display_options)
+    selected_month_str = st.selectbox("Select a month to analyze", options=list(available_months))
     
     if not selected_month_str:
         st.stop() # Exit if no month is selected
 
-    selected_month_period = available_months[month_display_options.index(selected_month_str)]
-    selected_month_start = selected_month_period.to_timestamp().date()
-    
-    # Get previous month
-    prev_month_period = selected_month_period - 1
-    prev_month_start = prev_month_period.to_timestamp().date()
+    selected_month_period = available_months[selected_month_str]
     
-    # Filter data for the two months
-    this_month_df = filtered_df[filtered_df['Date'].dt.to_period('M') == selected_month_period]
-    # Use df_expenses (which is only filtered by global date) for last_month_df and YTD calcs
-    last_month_df = df_expenses[df_expenses['Date'].dt.to_period('M') == prev_month_period] 
+    # Previous month is the year-month key minus one; last month and YTD use df_expenses (only filtered by global date)
+    selected_ym = selected_month_period.year * 12 + selected_month_period.month - 1
 
     # --- Insight Tabs ---
     insight_tab1, insight_tab2 = st.tabs(["By Category", "By Subcategory"])
@@ -229,32 +465,11 @@ def expenses_page():
     with insight_tab1:
         st.subheader(f"Category Insights for {selected_month_str}")
         
-        this_month_grouped = this_month_df.groupby('Category')['Amount'].sum()
-        last_month_grouped = last_month_df.groupby('Category')['Amount'].sum()
+        insights_df = _expense_insights(filtered_df, df_expenses, filter_key, 'Category', selected_ym)
         
-        all_insight_categories = sorted(list(set(this_month_grouped.index) | set(last_month_grouped.index)))
-        
-        if not all_insight_categories:
+        if insights_df.empty:
             st.info("No category spending data for this month.")
         else:
-            insights_data = []
-            for category in all_insight_categories:
-                this_month_spend = this_month_grouped.get(category, 0)
-                last_month_spend = last_month_grouped.get(category, 0)
-                
-                # YTD Average Calculation
-                ytd_avg_spend = calculate_ytd_average(df_expenses, 'Category', category, selected_month_start)
-                
-                insights_data.append({
-                    "Category": category,
-                    "This Month": this_month_spend,
-                    "Last Month": last_month_spend,
-                    "vs. Last Month (%)": (this_month_spend - last_month_spend) / last_month_spend * 100 if last_month_spend > 0 else np.inf,
-                    "vs. YTD Avg (%)": (this_month_spend - ytd_avg_spend) / ytd_avg_spend * 100 if ytd_avg_spend > 0 else np.inf
-                })
-
-            insights_df = pd.DataFrame(insights_data).sort_values(by=["vs. Last Month (%)","vs. YTD Avg (%)"])
-            
             st.dataframe(insights_df, 
                          column_config={
                              "This Month": st.column_config.NumberColumn(format=f"{currency_symbol}%.2f"),
@@ -267,32 +482,11 @@ def expenses_page():
     with insight_tab2:
         st.subheader(f"Subcategory Insights for {selected_month_str}")
         
-        this_month_grouped_sub = this_month_df.groupby('Subcategory')['Amount'].sum()
-        last_month_grouped_sub = last_month_df.groupby('Subcategory')['Amount'].sum()
-        
-        all_insight_subcategories = sorted(list(set(this_month_grouped_sub.index) | set(last_month_grouped_sub.index)))
+        insights_df_sub = _expense_insights(filtered_df, df_expenses, filter_key, 'Subcategory', selected_ym)
         
-        if not all_insight_subcategories:
+        if insights_df_sub.empty:
             st.info("No subcategory spending data for this month.")
         else:
-            insights_data_sub = []
-            for subcategory in all_insight_subcategories:
-                this_month_spend = this_month_grouped_sub.get(subcategory, 0)
-                last_month_spend = last_month_grouped_sub.get(subcategory, 0)
-                
-                # YTD Average Calculation
-                ytd_avg_spend = calculate_ytd_average(df_expenses, 'Subcategory', subcategory, selected_month_start)
-                
-                insights_data_sub.append({
-                    "Subcategory": subcategory,
-                    "This Month": this_month_spend,
-                    "Last Month": last_month_spend,
-                    "vs. Last Month (%)": (this_month_spend - last_month_spend) / last_month_spend * 100 if last_month_spend > 0 else np.inf,
-                    "vs. YTD Avg (%)": (this_month_spend - ytd_avg_spend) / ytd_avg_spend * 100 if ytd_avg_spend > 0 else np.inf
-                })
-
-            insights_df_sub = pd.DataFrame(insights_data_sub).sort_values(by=["vs. Last Month (%)","vs. YTD Avg (%)"])
-            
             st.dataframe(insights_df_sub, 
                          column_config={
                              "Subcategory": st.column_config.TextColumn("Subcategory"),
@@ -324,46 +518,48 @@ def expenses_page():
             key="trend_granularity"
         )
         if trend_granularity == "Category":
-            all_groups_in_df = sorted(filtered_df['Category'].unique())
+            all_groups_in_df = unique_sorted(filtered_df, filter_key, 'Category')
             group_col = 'Category'
         else:
-            all_groups_in_df = sorted(filtered_df['Subcategory'].unique())
+            all_groups_in_df = unique_sorted(filtered_df, filter_key, 'Subcategory')
             group_col = 'Subcategory'
     
     with col_filter:
         highlighted_cohorts = st.multiselect(f"Filter {trend_granularity} to display in highlight ", options=all_groups_in_df, key="trend_group_filter")
-    trend_df = filtered_df.copy()
     # if highlighted_cohorts:
-    trend_df = trend_df[trend_df[group_col].isin(highlighted_cohorts)]
-    color_sequence = px.colors.qualitative.Plotly + px.colors.qualitative.G10 + px.colors.qualitative.Alphabet
-    color_map = {group: color_sequence[i % len(color_sequence)] for i, group in enumerate(all_groups_in_df)}
+    trend_df = filtered_df[isin_mask(filtered_df[group_col], highlighted_cohorts)]
+    color_map = get_color_map(tuple(unique_sorted(df_expenses, expenses_key, group_col)))
+
+    # Long ranges are bucketed by week or month so the timeline doesn't draw a bar per day
+    timeline_bucket = timeline_freq(filtered_df['Date']) if not filtered_df.empty else 'D'
+    timeline_label = TIMELINE_LABELS[timeline_bucket]
+    trend_spend = _trend_aggregations(filtered_df, filter_key, group_col, timeline_bucket)
 
-    tab1, tab2, tab3, tab4 = st.tabs(["Daily Trend", "By Day of Week", "By Week of Month", "By Month"])
+    tab1, tab2, tab3, tab4 = st.tabs([f"{timeline_label} Trend", "By Day of Week", "By Week of Month", "By Month"])
 
     with tab1:
-        st.markdown("##### Daily Spending")
-        daily_spend = filtered_df.groupby([filtered_df['Date'].dt.date, group_col])['Amount'].sum().reset_index().rename(columns={'Date': 'Date_str'})
-        if not daily_spend.empty:
-            fig_daily_spend = px.bar(daily_spend, x='Date_str', y='Amount', color=group_col, 
-                                     labels={'Amount': 'Total Spend', 'Date_str': 'Date'},
-                                     color_discrete_map=color_map,
-                                     title=f"Daily Spending by {trend_granularity}")
-            fig_daily_spend.update_layout(xaxis_title='Date', yaxis_title=f'Amount ({currency_symbol})', height=400, barmode='stack')
-            st.plotly_chart(fig_daily_spend, use_container_width=True)
-
-            daily_metrics_df = trend_df.copy()
-            daily_metrics_df['period_bucket'] = daily_metrics_df['Date'].dt.date
+        st.markdown(f"##### {timeline_label} Spending")
+        timeline_spend = trend_spend['timeline']
+        if not timeline_spend.empty:
+            # Every real group has a color; only a folded tail group (if any) is missing and drawn in grey
+            timeline_colors = dict(color_map)
+            for group in timeline_spend[group_col].unique():
+                timeline_colors.setdefault(group, '#B0B0B0')
+            fig_timeline_spend = _stacked_bar_json(timeline_spend, 'Date_str', group_col, 'Date',
+                                                   f"{timeline_label} Spending by {trend_granularity}",
+                                                   timeline_colors, currency_symbol)
+            st.plotly_chart(pio.from_json(fig_timeline_spend), use_container_width=True)
 
             daily_metrics = build_trend_metrics(
-                daily_metrics_df,
+                trend_df,
                 group_col=group_col,
-                period_col_name='period_bucket'
+                period_col_name='_day'
             )
 
             render_trend_summary_cards(
                 daily_metrics,
                 group_col=group_col,
-                currency_symbol=currency_symbol,
+                fmt_money=fmt_money,
                 avg_label="Avg per Day"
             )
 
@@ -372,32 +568,23 @@ def expenses_page():
 
     with tab2:
         st.markdown("##### Spending by Day of the Week")
-        weekday_df = filtered_df.copy()
-        weekday_df['weekday'] = weekday_df['Date'].dt.day_name()
-        weekday_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-        weekday_df['weekday'] = pd.Categorical(weekday_df['weekday'], categories=weekday_order, ordered=True)
-        spend_by_weekday = weekday_df.groupby(['weekday', group_col])['Amount'].sum().reset_index()
+        spend_by_weekday = trend_spend['weekday']
         if not spend_by_weekday.empty:
-            fig_weekday_spend = px.bar(spend_by_weekday, x='weekday', y='Amount', color=group_col, 
-                                       labels={'Amount': 'Total Spend', 'weekday': 'Day of the Week'},
-                                       color_discrete_map=color_map,
-                                       title=f"Spending by Day of Week (by {trend_granularity})")
-            fig_weekday_spend.update_layout(xaxis_title='Day of the Week', yaxis_title=f'Amount ({currency_symbol})', height=400, barmode='stack')
-            st.plotly_chart(fig_weekday_spend, use_container_width=True)
-
-            weekday_metrics_df = trend_df.copy()
-            weekday_metrics_df['period_bucket'] = weekday_metrics_df['Date'].dt.day_name()
+            fig_weekday_spend = _stacked_bar_json(spend_by_weekday, 'weekday', group_col, 'Day of the Week',
+                                                  f"Spending by Day of Week (by {trend_granularity})",
+                                                  color_map, currency_symbol)
+            st.plotly_chart(pio.from_json(fig_weekday_spend), use_container_width=True)
 
             daily_metrics = build_trend_metrics(
-                weekday_metrics_df,
+                trend_df,
                 group_col=group_col,
-                period_col_name='period_bucket'
+                period_col_name='_wd'
             )
 
             render_trend_summary_cards(
                 daily_metrics,
                 group_col=group_col,
-                currency_symbol=currency_symbol,
+                fmt_money=fmt_money,
                 avg_label="Avg per Weekday"
             )
 
@@ -406,30 +593,23 @@ def expenses_page():
 
     with tab3:
         st.markdown("##### Spending by Week of the Month")
-        week_of_month_df = filtered_df.copy()
-        week_of_month_df['week_of_month'] = (week_of_month_df['Date'].dt.day - 1) // 7 + 1
-        spend_by_week = week_of_month_df.groupby(['week_of_month', group_col])['Amount'].sum().reset_index()
+        spend_by_week = trend_spend['week_of_month']
         if not spend_by_week.empty:
-            fig_week_spend = px.bar(spend_by_week, x='week_of_month', y='Amount', color=group_col, 
-                                    labels={'Amount': 'Total Spend', 'week_of_month': 'Week of the Month'},
-                                    color_discrete_map=color_map,
-                                    title=f"Spending by Week of Month (by {trend_granularity})")
-            fig_week_spend.update_layout(xaxis_title='Week of the Month', yaxis_title=f'Amount ({currency_symbol})', height=400, barmode='stack')
-            st.plotly_chart(fig_week_spend, use_container_width=True)
-
-            week_metrics_df = trend_df.copy()
-            week_metrics_df['period_bucket'] = (week_metrics_df['Date'].dt.day - 1) // 7 + 1
+            fig_week_spend = _stacked_bar_json(spend_by_week, 'week_of_month', group_col, 'Week of the Month',
+                                               f"Spending by Week of Month (by {trend_granularity})",
+                                               color_map, currency_symbol)
+            st.plotly_chart(pio.from_json(fig_week_spend), use_container_width=True)
 
             daily_metrics = build_trend_metrics(
-                week_metrics_df,
+                trend_df,
                 group_col=group_col,
-                period_col_name='period_bucket'
+                period_col_name='_wom'
             )
 
             render_trend_summary_cards(
                 daily_metrics,
                 group_col=group_col,
-                currency_symbol=currency_symbol,
+                fmt_money=fmt_money,
                 avg_label="Avg per Week"
             )
         else:
@@ -437,47 +617,31 @@ def expenses_page():
 
     with tab4:
         st.markdown("##### Spending by Month")
-        month_df = filtered_df.copy()
-        spend_by_month = month_df.groupby([pd.Grouper(key='Date', freq='MS'), group_col])['Amount'].sum().reset_index()
-        
-        # --- FIX: Sort by date to ensure chronological order ---
-        spend_by_month = spend_by_month.sort_values(by='Date')
-        
-        spend_by_month['month_str'] = spend_by_month['Date'].dt.strftime('%B %Y') 
+        spend_by_month = trend_spend['month']
         
         # --- NEW ROBUST FIX ---
         # Create an explicit list of the chronological month strings
         chronological_month_list = spend_by_month['month_str'].unique().tolist()
         
         if not spend_by_month.empty and spend_by_month['Amount'].sum() > 0:
-            fig_month_spend = px.bar(spend_by_month, x='month_str', y='Amount', color=group_col, 
-                                     labels={'Amount': 'Total Spend', 'month_str': 'Month'},
-                                     color_discrete_map=color_map,
-                                     title=f"Spending by Month (by {trend_granularity})")
-            
             # --- Tell Plotly to use the EXPLICIT order we just created ---
-            fig_month_spend.update_xaxes(
-                type='category',
-                categoryorder='array',
-                categoryarray=chronological_month_list
-            )
-            
-            fig_month_spend.update_layout(xaxis_title='Month', yaxis_title=f'Amount ({currency_symbol})', height=400, xaxis={'tickangle': -45}, barmode='stack')
-            st.plotly_chart(fig_month_spend, use_container_width=True)
-
-            month_metrics_df = trend_df.copy()
-            month_metrics_df['period_bucket'] = month_metrics_df['Date'].dt.to_period('M').astype(str)
+            fig_month_spend = _stacked_bar_json(spend_by_month, 'month_str', group_col, 'Month',
+                                                f"Spending by Month (by {trend_granularity})",
+                                                color_map, currency_symbol,
+                                                layout={'xaxis': {'tickangle': -45}},
+                                                xaxes={'type': 'category', 'categoryorder': 'array', 'categoryarray': chronological_month_list})
+            st.plotly_chart(pio.from_json(fig_month_spend), use_container_width=True)
 
             daily_metrics = build_trend_metrics(
-                month_metrics_df,
+                trend_df,
                 group_col=group_col,
-                period_col_name='period_bucket'
+                period_col_name='_yearmonth'
             )
 
             render_trend_summary_cards(
                 daily_metrics,
                 group_col=group_col,
-                currency_symbol=currency_symbol,
+                fmt_money=fmt_money,
                 avg_label="Avg per Month"
             )
 
@@ -489,29 +653,11 @@ def expenses_page():
     st.subheader("Category Deep Dive")
     st.markdown("Wondering where the bulk of your money goes? This hierarchical treemap makes it crystal clear. Click on a category (like 'Food & Dining') to see the subcategories inside. 🌳")
     
-    # Clean data for treemap: remove NaN paths
-    treemap_df = filtered_df.copy()
-    treemap_df['Category'] = treemap_df['Category'].fillna('Uncategorized')
-    treemap_df['Subcategory'] = treemap_df['Subcategory'].fillna('Uncategorized')
-    
+    treemap_df = _treemap_summary(filtered_df, filter_key)
+
     # Ensure there are no 0 values which can cause issues
     if treemap_df['Amount'].sum() > 0:
-        fig_treemap = px.treemap(
-            treemap_df,
-            path=[px.Constant("All Expenses"), 'Category', 'Subcategory'], # Hierarchical path
-            values='Amount',
-            color='Amount',
-            color_continuous_scale='Reds',
-            hover_data={'Amount': f':.2f'}
-        )
-        fig_treemap.update_layout(
-            title_text='Expense Breakdown by Category & Subcategory',
-            margin=dict(t=50, l=25, r=25, b=25)
-        )
-        fig_treemap.update_traces(
-            hovertemplate='<b>%{label}</b><br>Total Spend: ' + currency_symbol + '%{value:,.2f}<br>Percentage of Parent: %{percentParent:.1%}'
-        )
-        st.plotly_chart(fig_treemap, use_container_width=True)
+        st.plotly_chart(pio.from_json(_treemap_json(treemap_df, currency_symbol)), use_container_width=True)
     else:
         st.info("No positive spending data to display in the treemap.")
 
@@ -529,44 +675,14 @@ def expenses_page():
     )
     
     # Aggregate data based on selected granularity
-    grouped_habits = filtered_df.groupby(habit_granularity).agg(
-        Total_Spend=('Amount', 'sum'),
-        Frequency=('Amount', 'count'),
-        Avg_Spend=('Amount', 'mean'),
-        Most_Recent=('Date', 'max')
-    ).reset_index()
-    
+    grouped_habits = _habit_summary(filtered_df, filter_key, habit_granularity)
+
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown(f"##### 📊 Bubble Chart by {habit_granularity}")
         if not grouped_habits.empty:
-            fig_bubble = px.scatter(
-                grouped_habits,
-                x="Frequency",
-                y="Avg_Spend",
-                size="Total_Spend",
-                color=habit_granularity,
-                hover_name=habit_granularity,
-                size_max=60,
-                log_x=True,
-                log_y=True,
-                title=f"Spending Habits by {habit_granularity}"
-            )
-            fig_bubble.update_layout(
-                xaxis_title="Frequency (Number of Transactions)",
-                yaxis_title=f"Average Spend ({currency_symbol})",
-                height=500
-            )
-            fig_bubble.update_traces(
-                hovertemplate=(
-                    f'<b>%{{hovertext}}</b><br>' +
-                    'Frequency: %{x}<br>' +
-                    f'Avg. Spend: {currency_symbol}%{{y:,.2f}}<br>' +
-                    f'Total Spend: {currency_symbol}%{{marker.size:,.2f}}'
-                )
-            )
-            st.plotly_chart(fig_bubble, use_container_width=True)
+            st.plotly_chart(pio.from_json(_bubble_json(grouped_habits, habit_granularity, currency_symbol)), use_container_width=True)
         else:
             st.info("No data for bubble chart.")
 
@@ -591,8 +707,8 @@ def expenses_page():
     
     # --- NEW: Add local filters for the transaction table ---
     # Get available categories/subcategories from the *already filtered* dataframe
-    available_cats = ['All'] + sorted(filtered_df['Category'].unique())
-    available_subcats = ['All'] + sorted(filtered_df['Subcategory'].unique())
+    available_cats = ['All'] + unique_sorted(filtered_df, filter_key, 'Category')
+    available_subcats = ['All'] + unique_sorted(filtered_df, filter_key, 'Subcategory')
 
     col1, col2, col3 = st.columns([2,1,1])
     with col1:
@@ -605,22 +721,23 @@ def expenses_page():
         #st.markdown("##### ")
         table_filter_subcat = st.selectbox("Subcategories", options=available_subcats, key="table_subcat_filter")
 
-    # Create a copy to display
-    table_df = filtered_df.copy()
-
-    # Apply local filters
-    if table_filter_cat != 'All':
-        table_df = table_df[table_df['Category'] == table_filter_cat]
-    
-    if table_filter_subcat != 'All':
-        table_df = table_df[table_df['Subcategory'] == table_filter_subcat]
+    # Apply local filters as one combined mask (filter_rows returns a new frame, so no upfront copy is needed)
+    table_df = filter_rows(filtered_df, {
+        'Category': None if table_filter_cat == 'All' else (table_filter_cat,),
+        'Subcategory': None if table_filter_subcat == 'All' else (table_filter_subcat,)
+    })
     # --- END NEW FILTERS ---
 
     # Ensure Subcategory column is present
     if 'Subcategory' not in table_df.columns:
         table_df['Subcategory'] = table_df['Category'] # Fallback
         
-    st.dataframe(table_df[['Date', 'Amount', 'Category', 'Subcategory', 'Account', 'Type']], 
+    table_df = table_df[['Date', 'Amount', 'Category', 'Subcategory', 'Account', 'Type']]
+
+    # Only send the most recent rows to the browser; more are loaded on request
+    table_df = table_df.tail(table_row_limit(len(table_df), "expense_table"))
+
+    st.dataframe(table_df, 
                  use_container_width=True, 
                  hide_index=True,
                  column_config={
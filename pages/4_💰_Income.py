@@ -1,10 +1,8 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
 import plotly.express as px
-from datetime import datetime
-from utils import add_currency_selector, display_global_date_filter
-import calendar
+import plotly.io as pio
+from utils import add_currency_selector, display_global_date_filter, get_data_fingerprint, date_range_slice, get_color_map, percent_change, isin_mask, unique_sorted, selection_filter, filter_rows, year_month_keys, year_month_starts, monthly_totals
 import numpy as np
 
 st.set_page_config(
@@ -13,53 +11,177 @@ st.set_page_config(
     layout="wide"
 )
 
+# The only columns this page reads; the rest of processed_data is dropped up front
+INCOME_COLUMNS = ['Date', 'Amount', 'Account', 'Category', 'Subcategory']
+
 def format_currency(amount, currency_symbol):
     """Formats a number as currency."""
     return f"{currency_symbol}{amount:,.2f}"
 
-def calculate_ytd_comparison(df, group_col, item_name, selected_month_start):
+# --- Cached computations ---
+# Arguments starting with an underscore are not hashed by Streamlit; the key argument
+# (data fingerprint + filter selections) identifies them instead.
+
+@st.cache_data(show_spinner=False)
+def _subcategories_by_category(_df, df_key):
     """
-    Calculates the YTD comparison for a specific category/subcategory
-    against the first month of the year.
+    Maps each category to the sorted subcategories under it, so cascading filters are dict lookups.
     """
-    first_month_of_year = selected_month_start.replace(month=1)
-    
-    # --- FIX: Convert the datetime.date object to a Period object for comparison ---
-    first_month_period = pd.Period(first_month_of_year, freq='M')
-    
-    # Get data for the first month of the year
-    first_month_df = df[
-        (df['Date'].dt.to_period('M') == first_month_period) &
-        (df[group_col] == item_name)
-    ]
-    
-    first_month_spend = first_month_df['Amount'].sum()
-    return first_month_spend
+    return {category: sorted(subcategories) for category, subcategories in _df.groupby('Category', observed=True)['Subcategory'].unique().items()}
+
+@st.cache_data(show_spinner=False)
+def _prepare_income(_processed_data, data_fingerprint, start_date, end_date):
+    """
+    Returns the income transactions within the global date range.
+    """
+    # Filter by global date first
+    df = date_range_slice(_processed_data, start_date, end_date)
+    # Gather the income rows by position: one int index array instead of a bool mask plus copy
+    df_income = df[INCOME_COLUMNS].take(np.flatnonzero(isin_mask(df['Type'], ['Income'])))
+    # Integer month key (year * 12 + month - 1) so month lookups compare ints instead of Periods
+    df_income['_yearmonth'] = year_month_keys(df_income['Date'])
+    return df_income
+
+@st.cache_data(show_spinner=False)
+def _filter_income(_df_income, income_key, accounts, categories, subcategories):
+    """
+    Applies the Account, Category and Subcategory filters to the income frame.
+    """
+    return filter_rows(_df_income, {'Account': accounts, 'Category': categories, 'Subcategory': subcategories})
+
+@st.cache_data(show_spinner=False)
+def _monthly_income(_df_income, income_key, group_col):
+    """
+    Returns income per month and group in one pass: a frame indexed by the int
+    year-month key with 'total' and 'count' column blocks, one column per group.
+    """
+    return monthly_totals(_df_income, group_col)
+
+@st.cache_data(show_spinner=False)
+def _available_months(_df_income, income_key):
+    """
+    Returns the months with income as {display label: int year-month key}, newest first.
+    """
+    year_months = np.unique(_df_income['_yearmonth'].to_numpy())[::-1]
+    return dict(zip(year_month_starts(year_months).strftime('%B %Y'), year_months.tolist()))
+
+def calculate_ytd_comparison(monthly, selected_ym):
+    """
+    Returns each category/subcategory's income in the first month of the selected year.
+    """
+    first_month_ym = selected_ym - selected_ym % 12
+    if first_month_ym not in monthly.index:
+        return pd.Series(0.0, index=monthly['total'].columns)
+    return monthly['total'].loc[first_month_ym]
 
-# --- NEW FUNCTION ---
-def calculate_ytd_average_income(df, group_col, item_name, selected_month_start):
+def calculate_ytd_average_income(monthly, selected_ym):
     """
-    Calculates the YTD monthly average for a specific category/subcategory,
+    Calculates the YTD monthly average per category/subcategory,
     excluding the selected month, only for months with income.
     """
-    # Filter for YTD, *excluding* the selected month
-    ytd_df = df[
-        (df['Date'].dt.date < selected_month_start) &
-        (df['Date'].dt.date >= selected_month_start.replace(month=1, day=1)) &
-        (df[group_col] == item_name)
-    ]
-    
-    if ytd_df.empty:
-        return 0.0
+    ytd = monthly[(monthly.index >= selected_ym - selected_ym % 12) & (monthly.index < selected_ym)]
 
-    # Find number of unique months with income for this item
-    months_with_income = ytd_df['Date'].dt.to_period('M').nunique()
-    if months_with_income == 0:
-        return 0.0
-        
-    ytd_total = ytd_df['Amount'].sum()
-    return ytd_total / months_with_income
-# --- END NEW FUNCTION ---
+    # Find number of unique months with income for each item
+    months_with_income = (ytd['count'] > 0).sum()
+    ytd_total = ytd['total'].sum()
+    return (ytd_total / months_with_income.where(months_with_income > 0)).fillna(0.0)
+
+@st.cache_data(show_spinner=False)
+def _income_insights(_filtered_df, _df_income, filter_key, group_col, selected_ym):
+    """
+    Builds the YTD insight table for the items with income in the selected month:
+    this month vs. the first month of the year and vs. the YTD monthly average.
+    """
+    # Use filtered_df for "This Month"; the month's rows are only picked out on a cache miss
+    in_month = _filtered_df['_yearmonth'].to_numpy() == selected_ym
+    this_month_grouped = _filtered_df['Amount'][in_month].groupby(_filtered_df[group_col][in_month], observed=True).sum()
+    # Use df_income (global date filter only) for historical data
+    monthly = _monthly_income(_df_income, filter_key[0], group_col) # filter_key[0] is the income key
+    first_month_income = calculate_ytd_comparison(monthly, selected_ym).reindex(this_month_grouped.index, fill_value=0.0)
+    ytd_avg_income = calculate_ytd_average_income(monthly, selected_ym).reindex(this_month_grouped.index, fill_value=0.0)
+
+    this_month = this_month_grouped.to_numpy(dtype='float64')
+    first_month = first_month_income.to_numpy(dtype='float64')
+    ytd_avg = ytd_avg_income.to_numpy(dtype='float64')
+    insights_df = pd.DataFrame({
+        group_col: this_month_grouped.index,
+        "This Month's Income": this_month,
+        "First Month's Income": first_month,
+        "YTD Avg. Income": ytd_avg,
+        "vs. First Month (%)": percent_change(this_month, first_month),
+        "vs. YTD Avg (%)": percent_change(this_month, ytd_avg)
+    })
+    return insights_df.sort_values(by="This Month's Income", ascending=False)
+
+@st.cache_data(show_spinner=False)
+def _sunburst_json(_filtered_df, filter_key, currency_symbol):
+    """
+    Builds the income sunburst and returns it as Plotly JSON, or None when there is no income to show.
+    """
+    # Aggregate here so Plotly gets one row per subcategory instead of every transaction
+    # Missing subcategories are already 'Uncategorized' (see utils.prepare_processed_data)
+    sunburst_df = _filtered_df.groupby('Subcategory', observed=True, sort=False)['Amount'].sum().reset_index()
+    if not sunburst_df['Amount'].sum() > 0:
+        return None
+
+    fig_sunburst = px.sunburst(
+        sunburst_df,
+        path=['Subcategory'],#[px.Constant("All Income"), 'Category', 'Subcategory'],
+        values='Amount',
+        color='Amount',
+        color_continuous_scale='Greens',
+    )
+    fig_sunburst.update_layout(
+        title_text='Income Breakdown by Category & Subcategory',
+        margin=dict(t=50, l=25, r=25, b=25)
+    )
+    fig_sunburst.update_traces(
+        hovertemplate='<b>%{label}</b><br>Total Income: ' + currency_symbol + '%{value:,.2f}<br>Percentage of Parent: %{percentParent:.1%}',
+        textinfo="label+percent root"
+    )
+    return fig_sunburst.to_json()
+
+@st.cache_data(show_spinner=False)
+def _monthly_trend_json(_filtered_df, filter_key, group_col, color_map, currency_symbol):
+    """
+    Builds the stacked monthly income bar chart and returns it as Plotly JSON, or None when there is no income to show.
+    """
+    # The int month key sorts chronologically, so the groupby's own sort gives the chart order
+    spend_by_month = _filtered_df.groupby(['_yearmonth', group_col], observed=True)['Amount'].sum().reset_index()
+    if spend_by_month.empty or not spend_by_month['Amount'].sum() > 0:
+        return None
+    spend_by_month['month_str'] = year_month_starts(spend_by_month.pop('_yearmonth')).strftime('%B %Y')
+    chronological_month_list = spend_by_month['month_str'].unique().tolist()
+
+    fig_month_spend = px.bar(spend_by_month, x='month_str', y='Amount', color=group_col, 
+                             labels={'Amount': 'Total Income', 'month_str': 'Month'},
+                             color_discrete_map=color_map,
+                             title=f"Monthly Income Trend by {group_col}",
+                             text='Amount' # Add text labels
+                             )
+    
+    fig_month_spend.update_xaxes(
+        type='category',
+        categoryorder='array',
+        categoryarray=chronological_month_list
+    )
+    
+    # Format text labels
+    fig_month_spend.update_traces(
+        texttemplate=f'{currency_symbol}%{{y:,.0f}}', 
+        textposition='inside'
+    )
+    
+    fig_month_spend.update_layout(
+        xaxis_title='Month', 
+        yaxis_title=f'Amount ({currency_symbol})', 
+        height=400, 
+        xaxis={'tickangle': -45}, 
+        barmode='stack',
+        uniformtext_minsize=8, 
+        uniformtext_mode='hide'
+    )
+    return fig_month_spend.to_json()
 
 def income_page():
     """
@@ -76,9 +198,6 @@ def income_page():
         st.page_link("pages/1_📑_Data_Mapping.py", label="Go to Data Mapping", icon="🗺️")
         return
 
-    df = st.session_state.processed_data.copy()
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-
     # --- Global Date Filter ---
     display_global_date_filter()
     if st.session_state.get("global_start_date") is None:
@@ -88,13 +207,9 @@ def income_page():
     start_date = st.session_state.global_start_date
     end_date = st.session_state.global_end_date
     
-    # Filter by global date first
-    date_mask = (df['Date'].dt.date >= start_date) & (df['Date'].dt.date <= end_date)
-    df = df[date_mask]
-
     # --- Income Logic ---
-    income_mask = df['Type'] == 'Income'
-    df_income = df[income_mask].copy()
+    income_key = (get_data_fingerprint(), start_date, end_date)
+    df_income = _prepare_income(st.session_state.processed_data, *income_key)
 
     # --- Data Filtering (Account, Category, Subcategory) ---
     st.header("🗓️ Select Your Filters")
@@ -104,27 +219,27 @@ def income_page():
         col1, col2, col3 = st.columns(3)
 
         with col1:
-            all_accounts = sorted(df_income['Account'].unique())
+            all_accounts = unique_sorted(df_income, income_key, 'Account')
             selected_accounts = st.multiselect("Filter by Account(s)", options=all_accounts, default=all_accounts)
 
         with col2:
-            all_categories = sorted(df_income['Category'].unique())
+            all_categories = unique_sorted(df_income, income_key, 'Category')
             selected_categories = st.multiselect("Filter by Category(s)", options=all_categories, default=all_categories)
 
         with col3:
             if not selected_categories:
-                available_subcategories = sorted(df_income['Subcategory'].unique())
+                available_subcategories = unique_sorted(df_income, income_key, 'Subcategory')
             else:
-                available_subcategories = sorted(df_income[df_income['Category'].isin(selected_categories)]['Subcategory'].unique())
+                subcategories_by_category = _subcategories_by_category(df_income, income_key)
+                available_subcategories = sorted(set().union(*(subcategories_by_category[category] for category in selected_categories)))
             
             selected_subcategories = st.multiselect("Filter by Subcategory(s)", options=available_subcategories, default=available_subcategories)
 
     # Apply all filters
-    account_mask = df_income['Account'].isin(selected_accounts)
-    category_mask = df_income['Category'].isin(selected_categories)
-    subcategory_mask = df_income['Subcategory'].isin(selected_subcategories)
-
-    filtered_df = df_income[account_mask & category_mask & subcategory_mask]
+    # Filters with every option selected are passed as None and skipped
+    filter_key = (income_key, selection_filter(selected_accounts, all_accounts), selection_filter(selected_categories, all_categories),
+                  selection_filter(selected_subcategories, available_subcategories))
+    filtered_df = _filter_income(df_income, *filter_key)
 
     if filtered_df.empty:
         st.info("No income transactions found for the selected filters.", icon="🧐")
@@ -135,10 +250,12 @@ def income_page():
     st.header("📈 Income Metrics")
     st.markdown("Here are the key numbers for your income in this period.")
 
-    total_income = filtered_df['Amount'].sum()
-    num_transactions = len(filtered_df)
-    avg_income_event = total_income / num_transactions if num_transactions > 0 else 0
-    largest_income = filtered_df['Amount'].max()
+    # One pass each over the raw Amount buffer (filtered_df is non-empty here)
+    amounts = filtered_df['Amount'].to_numpy()
+    num_transactions = amounts.size
+    total_income = amounts.sum(dtype='float64')
+    avg_income_event = total_income / num_transactions
+    largest_income = amounts.max()
 
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
     with kpi1:
@@ -161,22 +278,17 @@ def income_page():
 
     # Get all unique months from the filtered data for the selector
     # Use df_income (only filtered by global date) to get all possible months
-    available_months = sorted(df_income['Date'].dt.to_period('M').unique(), reverse=True)
+    available_months = _available_months(df_income, income_key)
     if not available_months:
         st.info("Not enough data to generate insights.")
         st.stop()
 
-    month_display_options = [month.strftime('%B %Y') for month in available_months]
-    selected_month_str = st.selectbox("Select a month to analyze", options=month_display_options, key="income_insight_month")
+    selected_month_str = st.selectbox("Select a month to analyze", options=list(available_months), key="income_insight_month")
     
     if not selected_month_str:
         st.stop()
 
-    selected_month_period = available_months[month_display_options.index(selected_month_str)]
-    selected_month_start = selected_month_period.to_timestamp().date()
-    
-    # Use filtered_df for "This Month"
-    this_month_df = filtered_df[filtered_df['Date'].dt.to_period('M') == selected_month_period]
+    selected_ym = available_months[selected_month_str]
     
     insight_tab1, insight_tab2 = st.tabs(["By Category", "By Subcategory"])
 
@@ -184,30 +296,11 @@ def income_page():
         st.subheader(f"Category YTD Insights for {selected_month_str}")
         group_col = 'Category'
         
-        this_month_grouped_cat = this_month_df.groupby(group_col)['Amount'].sum()
-        # Use df_income (global date filter only) for historical data
-        all_insight_items_cat = sorted(df_income[df_income['Category'].isin(this_month_grouped_cat.index)]['Category'].unique())
+        insights_df_cat = _income_insights(filtered_df, df_income, filter_key, group_col, selected_ym)
         
-        if not all_insight_items_cat:
+        if insights_df_cat.empty:
             st.info(f"No income data for this month at the {group_col} level.")
         else:
-            insights_data_cat = []
-            for item in all_insight_items_cat:
-                this_month_income = this_month_grouped_cat.get(item, 0)
-                # Use df_income for historical calculations
-                first_month_income = calculate_ytd_comparison(df_income, group_col, item, selected_month_start)
-                ytd_avg_income = calculate_ytd_average_income(df_income, group_col, item, selected_month_start) # NEW
-                
-                insights_data_cat.append({
-                    group_col: item,
-                    "This Month's Income": this_month_income,
-                    "First Month's Income": first_month_income,
-                    "YTD Avg. Income": ytd_avg_income, # NEW
-                    "vs. First Month (%)": (this_month_income - first_month_income) / first_month_income * 100 if first_month_income > 0 else np.inf,
-                    "vs. YTD Avg (%)": (this_month_income - ytd_avg_income) / ytd_avg_income * 100 if ytd_avg_income > 0 else np.inf # NEW
-                })
-
-            insights_df_cat = pd.DataFrame(insights_data_cat).sort_values(by="This Month's Income", ascending=False)
             
             st.dataframe(insights_df_cat, 
                          column_config={
@@ -224,30 +317,11 @@ def income_page():
         st.subheader(f"Subcategory YTD Insights for {selected_month_str}")
         group_col = 'Subcategory'
 
-        this_month_grouped_sub = this_month_df.groupby(group_col)['Amount'].sum()
-        # Use df_income (global date filter only) for historical data
-        all_insight_items_sub = sorted(df_income[df_income['Subcategory'].isin(this_month_grouped_sub.index)]['Subcategory'].unique())
+        insights_df_sub = _income_insights(filtered_df, df_income, filter_key, group_col, selected_ym)
         
-        if not all_insight_items_sub:
+        if insights_df_sub.empty:
             st.info(f"No income data for this month at the {group_col} level.")
         else:
-            insights_data_sub = []
-            for item in all_insight_items_sub:
-                this_month_income = this_month_grouped_sub.get(item, 0)
-                # Use df_income for historical calculations
-                first_month_income = calculate_ytd_comparison(df_income, group_col, item, selected_month_start)
-                ytd_avg_income = calculate_ytd_average_income(df_income, group_col, item, selected_month_start) # NEW
-
-                insights_data_sub.append({
-                    group_col: item,
-                    "This Month's Income": this_month_income,
-                    "First Month's Income": first_month_income,
-                    "YTD Avg. Income": ytd_avg_income, # NEW
-                    "vs. First Month (%)": (this_month_income - first_month_income) / first_month_income * 100 if first_month_income > 0 else np.inf,
-                    "vs. YTD Avg (%)": (this_month_income - ytd_avg_income) / ytd_avg_income * 100 if ytd_avg_income > 0 else np.inf # NEW
-                })
-
-            insights_df_sub = pd.DataFrame(insights_data_sub).sort_values(by="This Month's Income", ascending=False)
             
             st.dataframe(insights_df_sub, 
                          column_config={
@@ -271,27 +345,9 @@ def income_page():
         st.subheader("Income Sources Breakdown")
         st.markdown("See where your income comes from, from broad categories to specific subcategories.")
         
-        sunburst_df = filtered_df.copy()
-        sunburst_df['Category'] = sunburst_df['Category'].fillna('Uncategorized')
-        sunburst_df['Subcategory'] = sunburst_df['Subcategory'].fillna('Uncategorized')
-        
-        if sunburst_df['Amount'].sum() > 0:
-            fig_sunburst = px.sunburst(
-                sunburst_df,
-                path=['Subcategory'],#[px.Constant("All Income"), 'Category', 'Subcategory'],
-                values='Amount',
-                color='Amount',
-                color_continuous_scale='Greens',
-            )
-            fig_sunburst.update_layout(
-                title_text='Income Breakdown by Category & Subcategory',
-                margin=dict(t=50, l=25, r=25, b=25)
-            )
-            fig_sunburst.update_traces(
-                hovertemplate='<b>%{label}</b><br>Total Income: ' + currency_symbol + '%{value:,.2f}<br>Percentage of Parent: %{percentParent:.1%}',
-                textinfo="label+percent root"
-            )
-            st.plotly_chart(fig_sunburst, use_container_width=True)
+        fig_sunburst = _sunburst_json(filtered_df, filter_key, currency_symbol)
+        if fig_sunburst is not None:
+            st.plotly_chart(pio.from_json(fig_sunburst), use_container_width=True)
         else:
             st.info("No income data to display in the sunburst chart.")
 
@@ -300,49 +356,11 @@ def income_page():
         st.subheader("Monthly Income Trend")
         group_col_trend = "Subcategory"
 
-        month_df = filtered_df.copy()
-        spend_by_month = month_df.groupby([pd.Grouper(key='Date', freq='MS'), group_col_trend])['Amount'].sum().reset_index()
-        
-        spend_by_month = spend_by_month.sort_values(by='Date')
-        spend_by_month['month_str'] = spend_by_month['Date'].dt.strftime('%B %Y') 
-        
-        chronological_month_list = spend_by_month['month_str'].unique().tolist()
-        
-        if not spend_by_month.empty and spend_by_month['Amount'].sum() > 0:
-            # Create color map
-            all_groups_in_df = sorted(filtered_df[group_col_trend].unique())
-            color_sequence = px.colors.qualitative.Plotly + px.colors.qualitative.G10
-            color_map = {group: color_sequence[i % len(color_sequence)] for i, group in enumerate(all_groups_in_df)}
-
-            fig_month_spend = px.bar(spend_by_month, x='month_str', y='Amount', color=group_col_trend, 
-                                     labels={'Amount': 'Total Income', 'month_str': 'Month'},
-                                     color_discrete_map=color_map,
-                                     title=f"Monthly Income Trend by {group_col_trend}",
-                                     text='Amount' # Add text labels
-                                     )
-            
-            fig_month_spend.update_xaxes(
-                type='category',
-                categoryorder='array',
-                categoryarray=chronological_month_list
-            )
-            
-            # Format text labels
-            fig_month_spend.update_traces(
-                texttemplate=f'{currency_symbol}%{{y:,.0f}}', 
-                textposition='inside'
-            )
-            
-            fig_month_spend.update_layout(
-                xaxis_title='Month', 
-                yaxis_title=f'Amount ({currency_symbol})', 
-                height=400, 
-                xaxis={'tickangle': -45}, 
-                barmode='stack',
-                uniformtext_minsize=8, 
-                uniformtext_mode='hide'
-            )
-            st.plotly_chart(fig_month_spend, use_container_width=True)
+        # Create color map from all income groups so colors don't shift with the filters
+        color_map = get_color_map(tuple(unique_sorted(df_income, income_key, group_col_trend)))
+        fig_month_spend = _monthly_trend_json(filtered_df, filter_key, group_col_trend, color_map, currency_symbol)
+        if fig_month_spend is not None:
+            st.plotly_chart(pio.from_json(fig_month_spend), use_container_width=True)
         else:
             st.info("No data to display for this period.")
 
@@ -355,7 +373,7 @@ def income_page():
     
     # --- NEW: Add local filters AND granularity for the transaction table ---
     
-    available_cats_table = ['All'] + sorted(filtered_df['Category'].unique())
+    available_cats_table = ['All'] + unique_sorted(filtered_df, filter_key, 'Category')
     
    
     with col2:
@@ -363,27 +381,21 @@ def income_page():
     
     with col3:
         if table_filter_cat == 'All':
-                    available_subcats_table = ['All'] + sorted(filtered_df['Subcategory'].unique())
+            available_subcats_table = ['All'] + unique_sorted(filtered_df, filter_key, 'Subcategory')
         else:
-            available_subcats_table = ['All'] + sorted(filtered_df[filtered_df['Category'] == table_filter_cat]['Subcategory'].unique())
+            available_subcats_table = ['All'] + _subcategories_by_category(filtered_df, filter_key)[table_filter_cat]
         
         table_filter_subcat = st.selectbox("Filter by Subcategory", options=available_subcats_table, key="table_subcat_filter_income")
                
     
-    table_df = filtered_df.copy()
-
-    if table_filter_cat != 'All':
-        table_df = table_df[table_df['Category'] == table_filter_cat]
-    
-    if table_filter_subcat != 'All':
-        table_df = table_df[table_df['Subcategory'] == table_filter_subcat]
-    
+    # Project first, then apply the local filters as one combined mask; filter_rows returns a new frame, so no copy
     columns_to_show = ['Date', 'Amount','Category', 'Subcategory', 'Account']
-
-    if 'Subcategory' not in table_df.columns:
-        table_df['Subcategory'] = table_df['Category']
+    table_df = filter_rows(filtered_df[columns_to_show], {
+        'Category': None if table_filter_cat == 'All' else (table_filter_cat,),
+        'Subcategory': None if table_filter_subcat == 'All' else (table_filter_subcat,)
+    })
         
-    st.dataframe(table_df[columns_to_show],
+    st.dataframe(table_df,
                  use_container_width=True, 
                  hide_index=True,
                  column_config={
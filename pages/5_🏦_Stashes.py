@@ -1,9 +1,7 @@
 import streamlit as st
 import pandas as pd
-from utils import add_currency_selector, display_global_date_filter # Updated imports
+from utils import add_currency_selector, display_global_date_filter, get_data_fingerprint, date_range_slice, year_month_keys, isin_mask, unique_sorted, selection_filter, filter_rows, EMOJI_OPTIONS, EMOJI_INDEX, table_row_limit # Updated imports
 import numpy as np
-from datetime import datetime, timedelta # Added timedelta
-from dateutil.relativedelta import relativedelta # Added for monthly projection
 
 st.set_page_config(
     page_title="Piso Patrol - Stashes",
@@ -11,50 +9,153 @@ st.set_page_config(
     layout="wide"
 )
 
+# The only columns read once the stash rows are picked out; Type is dropped with the rest
+STASH_COLUMNS = ['Date', 'Amount', 'Account', 'Category', 'Subcategory']
+
 def format_currency(amount, currency_symbol):
     """Formats a number as currency."""
     return f"{currency_symbol}{amount:,.2f}"
 
+def stash_rows(df, stash_subcategories):
+    """
+    Returns the stash transactions (Type 'Stash', or an 'Expense' in a stash subcategory),
+    projected to STASH_COLUMNS before the rows are gathered.
+    """
+    mask = isin_mask(df['Type'], ['Expense'])
+    mask &= isin_mask(df['Subcategory'], stash_subcategories)
+    mask |= isin_mask(df['Type'], ['Stash'])
+    return df[STASH_COLUMNS].take(np.flatnonzero(mask))
+
+# Last month a projection can land in (December 9999); anything later is shown as "Decades away"
+MAX_PROJECTION_YEAR_MONTH = 9999 * 12 + 11
+
 # --- NEW HELPER FUNCTION (MODIFIED) ---
-def calculate_projection_string(all_time_df, goal_amount):
+def calculate_projection_strings(all_time_stats, stash_goals):
     """
-    Calculates the estimated completion date for a stash goal
+    Calculates the estimated completion date for every stash goal at once,
     based on the average *monthly* savings rate, projecting from the last contribution.
+    all_time_stats is indexed by stash with 'total', 'first' and 'last'; returns a matching array of strings.
     """
-    if all_time_df.empty:
-        return "No contributions yet"
-    
-    total_saved_all_time = all_time_df['Amount'].sum()
-    
-    if total_saved_all_time >= goal_amount:
-        return "Goal Met! 🎉"
-        
-    first_contribution_date = all_time_df['Date'].min().date()
-    last_contribution_date = all_time_df['Date'].max().date()
-    
-    # Calculate number of months between first and last contribution
-    num_months = (last_contribution_date.year - first_contribution_date.year) * 12 + (last_contribution_date.month - first_contribution_date.month) + 1
-    
-    if num_months <= 0:
-        num_months = 1 # Avoid division by zero if all contributions in same month
-        
+    goal_amount = np.array([stash_goals.get(stash, 0) for stash in all_time_stats.index], dtype='float64')
+    total_saved_all_time = all_time_stats['total'].to_numpy(dtype='float64')
+    last_contribution = all_time_stats['last']
+    last_ym = year_month_keys(last_contribution).astype('int64')
+
+    # Number of months between first and last contribution, at least 1 (all in the same month)
+    num_months = np.maximum(last_ym - year_month_keys(all_time_stats['first']) + 1, 1)
     avg_monthly_rate = total_saved_all_time / num_months
+
+    projections = np.select(
+        [total_saved_all_time >= goal_amount, avg_monthly_rate <= 0],
+        ["Goal Met! 🎉", "Never (at this rate)"],
+        default=""
+    ).astype(object)
+
+    pending = np.flatnonzero(projections == "")
+    # Use ceiling to round up to the next full month, projecting from the *last* contribution date
+    target_ym = last_ym[pending] + np.ceil((goal_amount[pending] - total_saved_all_time[pending]) / avg_monthly_rate[pending])
+    too_far = target_ym > MAX_PROJECTION_YEAR_MONTH
+    projections[pending[too_far]] = "Decades away"
+
+    pending, target_ym = pending[~too_far], target_ym[~too_far].astype('int64')
+    month_starts = (target_ym - 1970 * 12).astype('datetime64[M]')
+    # Keep the day of the last contribution, clipped to the length of the target month
+    days_in_month = ((month_starts + 1).astype('datetime64[D]') - month_starts.astype('datetime64[D]')).astype('int64')
+    days = np.minimum(last_contribution.dt.day.to_numpy()[pending], days_in_month)
+    estimated_dates = month_starts.astype('datetime64[D]') + (days - 1)
+    projections[pending] = pd.DatetimeIndex(estimated_dates).strftime('Est. %b %d, %Y')
+    return projections
+
+@st.cache_data(show_spinner=False)
+def _all_time_stash_stats(_all_df, data_fingerprint, stash_goals):
+    """
+    Returns {stash: {'total', 'first', 'last', 'projection'}} over all stash transactions, ignoring the date filter.
+    stash_goals is a sorted tuple of (stash, goal) pairs, so this only reruns when the data or the goals change.
+    """
+    df_stashes_all_time = stash_rows(_all_df, [stash for stash, _ in stash_goals])
+    all_time_stats = df_stashes_all_time.groupby('Subcategory', observed=True).agg(
+        total=('Amount', 'sum'),
+        first=('Date', 'min'),
+        last=('Date', 'max')
+    )
+    all_time_stats['projection'] = calculate_projection_strings(all_time_stats, dict(stash_goals))
+    return all_time_stats.to_dict('index')
+# --- END NEW FUNCTION ---
+
+@st.cache_data(show_spinner=False)
+def _prepare_stashes(_processed_data, stash_key):
+    """
+    Returns the stash transactions in the global date range.
+    Cached per stash_key, so the Type/Subcategory masks only run when the data, dates or stash set change.
+    """
+    _, _, start_date, end_date, stash_subcategories = stash_key
+    return stash_rows(date_range_slice(_processed_data, start_date, end_date), stash_subcategories)
+
+@st.cache_data(show_spinner=False)
+def _period_stash_stats(_filtered_df, filter_key):
+    """
+    Returns {stash: {'Contributed_in_Period', 'Contributions_in_Period', 'Avg_Contribution_in_Period'}}
+    for the page-filtered stash transactions, so goal and emoji edits don't redo the groupby.
+    """
+    # One bincount pass over the category codes instead of three groupby reductions
+    subcategories = _filtered_df['Subcategory'].cat.categories
+    codes = _filtered_df['Subcategory'].cat.codes.to_numpy()
+    totals = np.bincount(codes, weights=_filtered_df['Amount'].to_numpy(dtype='float64'), minlength=len(subcategories))
+    counts = np.bincount(codes, minlength=len(subcategories))
+    return {
+        subcategories[i]: {
+            'Contributed_in_Period': totals[i],
+            'Contributions_in_Period': counts[i],
+            'Avg_Contribution_in_Period': totals[i] / counts[i]
+        }
+        for i in np.flatnonzero(counts)
+    }
+
+@st.fragment
+def stash_definition_editor(all_expense_subcategories):
+    """
+    Renders the stash goal and emoji editor. Runs as a fragment, so changing a goal or emoji
+    only reruns this block; saving reruns the whole page to pick up the new definitions.
+    """
+    col1, col2, col3 = st.columns([2, 2, 1])
     
-    if avg_monthly_rate <= 0:
-        return "Never (at this rate)"
-        
-    remaining_amount = goal_amount - total_saved_all_time
-    # Use ceiling to round up to the next full month
-    months_remaining = int(np.ceil(remaining_amount / avg_monthly_rate))
+    with col1:
+        st.markdown("**Select Stash Subcategories**")
+        selected_stashes = st.multiselect(
+            "Select **subcategories** to track as stashes:",
+            options=all_expense_subcategories,
+            default=list(st.session_state.stash_goals.keys()),
+            key="stash_multiselect_editor"
+        )
+
+    temp_goals = {}
+    temp_emojis = {}
+
+    with col2:
+        st.markdown("**Set Your Goals**")
+        for stash in selected_stashes:
+            temp_goals[stash] = st.number_input(
+                f"Goal for {stash} ($)",
+                min_value=0.0,
+                value=st.session_state.stash_goals.get(stash, 0.0), # Recall
+                key=f"goal_editor_{stash}"
+            )
     
-    try:
-        # Project from the *last* contribution date, as requested
-        estimated_date = last_contribution_date + relativedelta(months=months_remaining)
-        return f"Est. {estimated_date.strftime('%b %d, %Y')}"
-    except OverflowError:
-        # Handle cases where the date is too far in the future
-        return "Decades away"
-# --- END NEW FUNCTION ---
+    with col3:
+        st.markdown("**Assign Emojis**")
+        for stash in selected_stashes:
+            temp_emojis[stash] = st.selectbox(
+                f"Emoji for {stash}",
+                options=EMOJI_OPTIONS,
+                index=EMOJI_INDEX[st.session_state.stash_emojis.get(stash, "🏦")], # Recall
+                key=f"emoji_editor_{stash}"
+            )
+    
+    if st.button("Save Stash Definitions", type="primary", key="save_stash_editor"):
+        st.session_state.stash_goals = temp_goals
+        st.session_state.stash_emojis = temp_emojis
+        st.success("Stash goals and emojis have been saved!", icon="✅")
+        st.rerun()
 
 def stashes_page():
     add_currency_selector()
@@ -75,8 +176,8 @@ def stashes_page():
         st.session_state.stash_emojis = {}
         
     # Main dataframe for this page
-    all_df = st.session_state.processed_data.copy()
-    all_df['Date'] = pd.to_datetime(all_df['Date'], errors='coerce')
+    # Read-only here and Date is already datetime64 (see utils.store_processed_data), so no copy
+    all_df = st.session_state.processed_data
     
     # --- NEW: Global Date Filter ---
     display_global_date_filter()
@@ -87,22 +188,17 @@ def stashes_page():
     start_date = st.session_state.global_start_date
     end_date = st.session_state.global_end_date
     
-    # Filter by global date first
-    date_mask = (all_df['Date'].dt.date >= start_date) & (all_df['Date'].dt.date <= end_date)
-    df = all_df[date_mask] # df is now the *filtered* dataframe
-    
     # --- Correct Stash Logic ---
-    stash_subcategories = st.session_state.get('stash_goals', {}).keys()
+    stash_subcategories = tuple(sorted(st.session_state.get('stash_goals', {}).keys()))
     
-    # Get ALL stash transactions from the *unfiltered* dataframe for projections
-    stash_mask_all_time = (all_df['Type'] == 'Stash') | \
-                         ((all_df['Type'] == 'Expense') & (all_df['Subcategory'].isin(stash_subcategories)))
-    df_stashes_all_time = all_df[stash_mask_all_time].copy()
+    # Get ALL-TIME stash totals and goal projections from the *unfiltered* dataframe
+    all_time_stats = _all_time_stash_stats(all_df, get_data_fingerprint(), tuple(sorted(st.session_state.get('stash_goals', {}).items())))
     
-    # Get stash transactions from the *filtered* dataframe for period metrics
-    stash_mask_filtered = (df['Type'] == 'Stash') | \
-                         ((df['Type'] == 'Expense') & (df['Subcategory'].isin(stash_subcategories)))
-    df_stashes_filtered = df[stash_mask_filtered].copy()
+    # Identifies df_stashes_filtered for the cached helpers; tagged with the page because
+    # unique_sorted's cache is shared with the other pages (the Expenses key has the same fields)
+    stash_key = ('stashes', get_data_fingerprint(), start_date, end_date, stash_subcategories)
+    # Get stash transactions from the global date range for period metrics
+    df_stashes_filtered = _prepare_stashes(all_df, stash_key)
 
     # --- NEW: Standard Page Filters ---
     st.header("🗓️ Select Your Filters")
@@ -113,21 +209,21 @@ def stashes_page():
 
         with col1:
             # Use df_stashes_filtered to get available filter options
-            all_accounts = sorted(df_stashes_filtered['Account'].unique())
+            all_accounts = unique_sorted(df_stashes_filtered, stash_key, 'Account')
             selected_accounts = st.multiselect("Filter by Account(s)", options=all_accounts, default=all_accounts, key="stash_account_filter")
 
         with col2:
-            all_categories = sorted(df_stashes_filtered['Category'].unique())
+            all_categories = unique_sorted(df_stashes_filtered, stash_key, 'Category')
             selected_categories = st.multiselect("Filter by Category(s)", options=all_categories, default=all_categories, key="stash_cat_filter")
 
         with col3:
             if not selected_categories:
-                available_subcategories = sorted(df_stashes_filtered['Subcategory'].unique())
+                available_subcategories = unique_sorted(df_stashes_filtered, stash_key, 'Subcategory')
             else:
-                available_subcategories = sorted(df_stashes_filtered[df_stashes_filtered['Category'].isin(selected_categories)]['Subcategory'].unique())
+                available_subcategories = unique_sorted(df_stashes_filtered, stash_key, 'Subcategory', 'Category', tuple(selected_categories))
             
             # Default to only the defined stash subcategories that are *also* in the filtered data
-            default_subcategories = [s for s in available_subcategories if s in stash_subcategories]
+            default_subcategories = pd.Index(available_subcategories).intersection(stash_subcategories, sort=False).tolist()
             selected_subcategories = st.multiselect("Filter by Subcategory(s)", options=available_subcategories, default=default_subcategories, key="stash_subcat_filter")
 
     # --- NEW: Resurfaced Stash Definition Editor ---
@@ -137,64 +233,24 @@ def stashes_page():
 
     with st.expander("Edit Stash Goals & Emojis", expanded=False):
         # We must get ALL possible subcategories from the *entire* dataset
-        all_expense_subcategories = sorted(all_df[
-            (all_df['Type'] == 'Expense') | 
-            (all_df['Type'] == 'Stash')
-        ]['Subcategory'].unique())
+        all_expense_subcategories = unique_sorted(all_df, ('processed_data', get_data_fingerprint()), 'Subcategory', 'Type', ('Expense', 'Stash'))
 
         if not all_expense_subcategories:
             st.info("No expense or stash subcategories found in your data.")
         else:
-            emoji_options = ["🏦", "💰", "✈️", "🚗", "🏠", "🎓", "🎁", "💻"]
-
-            col1, col2, col3 = st.columns([2, 2, 1])
-            
-            with col1:
-                st.markdown("**Select Stash Subcategories**")
-                selected_stashes = st.multiselect(
-                    "Select **subcategories** to track as stashes:",
-                    options=all_expense_subcategories,
-                    default=list(st.session_state.stash_goals.keys()),
-                    key="stash_multiselect_editor"
-                )
-
-            temp_goals = {}
-            temp_emojis = {}
-
-            with col2:
-                st.markdown("**Set Your Goals**")
-                for stash in selected_stashes:
-                    temp_goals[stash] = st.number_input(
-                        f"Goal for {stash} ($)",
-                        min_value=0.0,
-                        value=st.session_state.stash_goals.get(stash, 0.0), # Recall
-                        key=f"goal_editor_{stash}"
-                    )
-            
-            with col3:
-                st.markdown("**Assign Emojis**")
-                for stash in selected_stashes:
-                    temp_emojis[stash] = st.selectbox(
-                        f"Emoji for {stash}",
-                        options=emoji_options,
-                        index=emoji_options.index(st.session_state.stash_emojis.get(stash, "🏦")), # Recall
-                        key=f"emoji_editor_{stash}"
-                    )
-            
-            if st.button("Save Stash Definitions", type="primary", key="save_stash_editor"):
-                st.session_state.stash_goals = temp_goals
-                st.session_state.stash_emojis = temp_emojis
-                st.success("Stash goals and emojis have been saved!", icon="✅")
-                st.rerun() 
+            stash_definition_editor(all_expense_subcategories)
 
     # --- End of new section ---
 
     # Apply all page filters
-    account_mask = df_stashes_filtered['Account'].isin(selected_accounts)
-    category_mask = df_stashes_filtered['Category'].isin(selected_categories)
-    subcategory_mask = df_stashes_filtered['Subcategory'].isin(selected_subcategories)
-
-    filtered_df = df_stashes_filtered[account_mask & category_mask & subcategory_mask] # This is now the *displayed* data
+    # Filters with every option selected are skipped
+    selections = {
+        'Account': selection_filter(selected_accounts, all_accounts),
+        'Category': selection_filter(selected_categories, all_categories),
+        'Subcategory': selection_filter(selected_subcategories, available_subcategories)
+    }
+    filtered_df = filter_rows(df_stashes_filtered, selections) # This is now the *displayed* data
+    filter_key = (stash_key, *selections.values())
 
     if filtered_df.empty and not stash_subcategories:
         st.info("No stash goals defined. Please set your goals in the 'Edit Stash Definitions' section above or on the 'Data Mapping' page.", icon="🏦")
@@ -213,16 +269,7 @@ def stashes_page():
     stash_emojis = st.session_state.get('stash_emojis', {})
 
     # Calculate totals from the *filtered* data (for period metrics)
-    grouped_stashes_filtered = filtered_df.groupby('Subcategory').agg(
-        Contributed_in_Period=('Amount', 'sum'),
-        Contributions_in_Period=('Amount', 'count'),
-        Avg_Contribution_in_Period=('Amount', 'mean')
-    ).to_dict('index')
-    
-    # Calculate totals from *all* data (for progress bar & projection)
-    grouped_stashes_all_time = df_stashes_all_time.groupby('Subcategory').agg(
-        Total_Saved_All_Time=('Amount', 'sum')
-    ).to_dict('index')
+    grouped_stashes_filtered = _period_stash_stats(filtered_df, filter_key)
     
     # We will display ALL defined stashes, regardless of filter
     stashes_to_show = sorted(list(stash_goals.keys()))
@@ -240,8 +287,8 @@ def stashes_page():
         emoji = stash_emojis.get(stash_name, "🏦")
         
         # Get ALL-TIME metrics
-        all_time_data = grouped_stashes_all_time.get(stash_name)
-        total_saved_all_time = all_time_data['Total_Saved_All_Time'] if all_time_data else 0
+        all_time_data = all_time_stats.get(stash_name)
+        total_saved_all_time = all_time_data['total'] if all_time_data else 0
         
         # Get FILTERED metrics
         filtered_data = grouped_stashes_filtered.get(stash_name)
@@ -253,27 +300,28 @@ def stashes_page():
         attainment = (total_saved_all_time / goal_amount) * 100 if goal_amount > 0 else 0
         progress_bar_value = min(attainment / 100, 1.0)
         
-        # Calculate projection
-        projection = calculate_projection_string(
-            df_stashes_all_time[df_stashes_all_time['Subcategory'] == stash_name],
-            goal_amount
-        )
+        # Projection (computed for all stashes at once)
+        projection = all_time_data['projection'] if all_time_data else "No contributions yet"
         
         with cols[col_index % total_columns]:
+            # Static text is batched into as few markdown elements as possible; each element is a separate message to the browser
             with st.container(border=True):
-                st.markdown(f"<h5>{emoji} {stash_name}</h5>", unsafe_allow_html=True)
-                
                 # Goal and Progress (based on ALL-TIME data)
-                st.markdown(f"**Goal:** {format_currency(goal_amount, currency_symbol)}")
+                st.markdown(
+                    f"<h5>{emoji} {stash_name}</h5>\n\n"
+                    f"**Goal:** {format_currency(goal_amount, currency_symbol)}",
+                    unsafe_allow_html=True
+                )
                 st.progress(progress_bar_value, text=f"{attainment:.1f}% Complete")
-                st.markdown(f"**Total Saved:** {format_currency(total_saved_all_time, currency_symbol)}")
-                st.markdown(f"**Est. Goal Date:** {projection}")
-                
-                # Metrics (based on FILTERED data)
-                st.markdown("---")
-                st.markdown(f"**Contributed (in period):** {format_currency(contributed_in_period, currency_symbol)}")
-                st.markdown(f"**Contributions (in period):** {contributions_in_period}")
-                st.markdown(f"**Avg. Contribution (in period):** {format_currency(avg_contribution_in_period, currency_symbol)}")
+                st.markdown(
+                    f"**Total Saved:** {format_currency(total_saved_all_time, currency_symbol)}\n\n"
+                    f"**Est. Goal Date:** {projection}\n\n"
+                    # Metrics (based on FILTERED data)
+                    "---\n\n"
+                    f"**Contributed (in period):** {format_currency(contributed_in_period, currency_symbol)}\n\n"
+                    f"**Contributions (in period):** {contributions_in_period}\n\n"
+                    f"**Avg. Contribution (in period):** {format_currency(avg_contribution_in_period, currency_symbol)}"
+                )
         
         col_index += 1
         
@@ -286,7 +334,7 @@ def stashes_page():
     st.markdown("##### Filter this table:")
     
     # Use the FILTEERED df for these options
-    available_cats_table = ['All'] + sorted(filtered_df['Category'].unique())
+    available_cats_table = ['All'] + unique_sorted(filtered_df, filter_key, 'Category')
     
     col1, col2 = st.columns(2)
     with col1:
@@ -294,28 +342,24 @@ def stashes_page():
 
     with col2:
         if table_filter_cat == 'All':
-            available_subcats_table = ['All'] + sorted(filtered_df['Subcategory'].unique())
+            available_subcats_table = ['All'] + unique_sorted(filtered_df, filter_key, 'Subcategory')
         else:
-            available_subcats_table = ['All'] + sorted(filtered_df[filtered_df['Category'] == table_filter_cat]['Subcategory'].unique())
+            available_subcats_table = ['All'] + unique_sorted(filtered_df, filter_key, 'Subcategory', 'Category', (table_filter_cat,))
         
         table_filter_subcat = st.selectbox("Filter by Subcategory", options=available_subcats_table, key="table_subcat_filter_stash")
 
-    # Create a copy to display
-    table_df = filtered_df.copy() # Start with the page-filtered data
-
-    # Apply local filters
-    if table_filter_cat != 'All':
-        table_df = table_df[table_df['Category'] == table_filter_cat]
-    
-    if table_filter_subcat != 'All':
-        table_df = table_df[table_df['Subcategory'] == table_filter_subcat]
-    
-    # Columns to show
+    # Columns to show; projected before the local filters so only these are masked
     columns_to_show = ['Date', 'Amount', 'Category', 'Subcategory', 'Account']
-    if 'Subcategory' not in table_df.columns:
-        table_df['Subcategory'] = table_df['Category'] # Fallback
+    # Start with the page-filtered data and apply the local filters as one combined mask
+    table_df = filter_rows(filtered_df[columns_to_show], {
+        'Category': None if table_filter_cat == 'All' else (table_filter_cat,),
+        'Subcategory': None if table_filter_subcat == 'All' else (table_filter_subcat,)
+    })
+
+    # Only send the most recent rows to the browser; 'Show all' or the slider load more
+    table_df = table_df.tail(table_row_limit(len(table_df), "stash_table"))
         
-    st.dataframe(table_df[columns_to_show],
+    st.dataframe(table_df,
                  use_container_width=True, 
                  hide_index=True,
                  column_config={
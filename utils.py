@@ -1,26 +1,269 @@
 import streamlit as st
 from datetime import datetime, timedelta
+from functools import lru_cache
+import hashlib
+import numpy as np
 import pandas as pd
+import plotly.express as px
+
+CURRENCY_OPTIONS = {
+    "USD ($)": "$",
+    "PHP (₱)": "₱",
+    "EUR (€)": "€",
+    "GBP (£)": "£",
+    "JPY (¥)": "¥",
+}
+
+# Emojis offered for stashes, and each emoji's position for the selectbox index
+EMOJI_OPTIONS = ("🏦", "💰", "✈️", "🚗", "🏠", "🎓", "🎁", "💻")
+EMOJI_INDEX = {emoji: i for i, emoji in enumerate(EMOJI_OPTIONS)}
 
 def add_currency_selector():
     st.sidebar.markdown("---")
     st.sidebar.header("💱 Currency Selector")
     
-    currency_options = {
-        "USD ($)": "$",
-        "PHP (₱)": "₱",
-        "EUR (€)": "€",
-        "GBP (£)": "£",
-        "JPY (¥)": "¥",
-    }
-    
     selected_currency_label = st.sidebar.selectbox(
         "Choose your currency",
-        options=list(currency_options.keys()),
+        options=tuple(CURRENCY_OPTIONS),
         key="selected_currency"
     )
     
-    st.session_state.currency_symbol = currency_options[selected_currency_label]
+    st.session_state.currency_symbol = CURRENCY_OPTIONS[selected_currency_label]
+
+def _fingerprint(df):
+    """Returns a sha1 of the DataFrame's contents (values and index)."""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()).hexdigest()
+
+# Repeated labels stored as categoricals: comparisons, isin and groupby work on the integer codes
+CATEGORICAL_COLUMNS = ('Account', 'Category', 'Subcategory', 'Type')
+# Missing labels in these columns are filled once here, so charts never need a per-rerun fillna
+UNCATEGORIZED = 'Uncategorized'
+LABEL_COLUMNS = ('Category', 'Subcategory')
+
+def prepare_processed_data(df):
+    """
+    Converts the Date column to datetime and the repeated label columns to categoricals,
+    fills missing categories with 'Uncategorized' and sorts the rows by Date.
+    """
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = df[col].astype('category')
+    for col in LABEL_COLUMNS:
+        if df[col].hasnans:
+            labels = df[col]
+            if UNCATEGORIZED not in labels.cat.categories:
+                labels = labels.cat.add_categories([UNCATEGORIZED])
+            df[col] = labels.fillna(UNCATEGORIZED)
+    # Kept in date order so date ranges can be cut with a binary search (see date_range_slice)
+    if not df['Date'].is_monotonic_increasing:
+        df = df.sort_values('Date', kind='stable', ignore_index=True)
+    return df
+
+def store_processed_data(df):
+    """
+    Saves the cleaned transactions to session_state in their compact dtypes and records
+    a content fingerprint that cached page helpers use as their key.
+    """
+    df = prepare_processed_data(df)
+    st.session_state.processed_data = df
+    st.session_state.data_fingerprint = (id(df), _fingerprint(df))
+    st.session_state.date_bounds = (id(df), *_date_bounds(df))
+
+def get_data_fingerprint():
+    """
+    Returns the fingerprint of processed_data, recomputing it if the stored one
+    belongs to a different DataFrame (e.g. data saved before fingerprints existed).
+    """
+    df = st.session_state.processed_data
+    stored = st.session_state.get("data_fingerprint")
+    if stored is None or stored[0] != id(df):
+        stored = (id(df), _fingerprint(df))
+        st.session_state.data_fingerprint = stored
+    return stored[1]
+
+def _date_bounds(df):
+    """
+    Returns the first and last date of a Date-sorted DataFrame (see prepare_processed_data)
+    by reading its ends instead of scanning the column; unparseable (NaT) dates sort last and are skipped.
+    Returns (None, None) when there are no valid dates.
+    """
+    dates = df['Date']
+    if dates.empty or pd.isna(dates.iat[-1]):
+        dates = dates.dropna()
+        if dates.empty:
+            return None, None
+    return dates.iat[0].date(), dates.iat[-1].date()
+
+def get_date_bounds():
+    """
+    Returns the (min_date, max_date) of processed_data, scanning the Date column only
+    when the stored bounds belong to a different DataFrame.
+    """
+    df = st.session_state.processed_data
+    stored = st.session_state.get("date_bounds")
+    if stored is None or stored[0] != id(df):
+        stored = (id(df), *_date_bounds(df))
+        st.session_state.date_bounds = stored
+    return stored[1], stored[2]
+
+def date_range_slice(df, start_date, end_date):
+    """
+    Returns the rows of a Date-sorted DataFrame from start_date to end_date (both inclusive).
+    Finds the bounds with a binary search and slices by position, so no mask is built.
+    """
+    start = np.datetime64(start_date, 'D')
+    end = np.datetime64(end_date, 'D') + np.timedelta64(1, 'D')
+    lo, hi = np.searchsorted(df['Date'].to_numpy(), [start, end])
+    return df.iloc[lo:hi]
+
+def isin_mask(series, values):
+    """
+    Returns series.isin(values) as a boolean array. For categoricals the selected labels are
+    turned into a set of codes and the codes are matched with a lookup table (np.isin kind='table').
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.isin(values).to_numpy()
+    selected_codes = np.flatnonzero(series.cat.categories.isin(values))
+    return np.isin(series.cat.codes.to_numpy(), selected_codes, kind='table')
+
+def selection_filter(selected, options):
+    """
+    Returns a multiselect selection as a tuple for filter keys, or None when every option
+    is selected so the filter can be skipped (see filter_rows).
+    """
+    return None if len(selected) == len(options) else tuple(selected)
+
+def filter_rows(df, selections):
+    """
+    Returns the rows of df whose values are in the selected labels, given {column: selected}.
+    Columns whose selection is None are not filtered; if none are, df itself is returned.
+    """
+    mask = None
+    for col, selected in selections.items():
+        if selected is None:
+            continue
+        # One mask, narrowed in place by each filter
+        if mask is None:
+            mask = isin_mask(df[col], selected)
+        else:
+            mask &= isin_mask(df[col], selected)
+    return df if mask is None else df[mask]
+
+def year_month_keys(dates):
+    """
+    Returns the int16 year-month key (year * 12 + month - 1) of each date, the inverse of
+    year_month_starts. One cast to datetime64[M] replaces separate year and month extraction.
+    """
+    return (dates.to_numpy().astype('datetime64[M]').astype('int64') + 1970 * 12).astype('int16')
+
+def year_month_starts(year_months):
+    """
+    Converts integer year-month keys (year * 12 + month - 1) to a DatetimeIndex of month starts.
+    datetime64[M] counts months from 1970, so one shift and cast handles the whole array.
+    """
+    return pd.DatetimeIndex((np.asarray(year_months) - 1970 * 12).astype('datetime64[M]'))
+
+def monthly_totals(df, group_col):
+    """
+    Returns the sum and count of Amount per int year-month key and group: a frame indexed by
+    '_yearmonth' with 'total' and 'count' column blocks, one column per group present in df.
+    Both are accumulated with np.bincount over a flattened (month, group code) key.
+    """
+    labels = df[group_col]
+    if isinstance(labels.dtype, pd.CategoricalDtype):
+        codes, groups = labels.cat.codes.to_numpy(), labels.cat.categories
+    else:
+        codes, groups = pd.factorize(labels)
+    keep = codes >= 0 # Missing labels are dropped, as groupby does
+    year_months = df['_yearmonth'].to_numpy()[keep].astype('int64')
+    first_month = year_months.min() if len(year_months) else 0
+    n_months = (year_months.max() - first_month + 1) if len(year_months) else 0
+    n_groups = len(groups)
+
+    key = (year_months - first_month) * n_groups + codes[keep]
+    # Weights are read as float64, so float32 amounts are still totalled to the cent
+    total = np.bincount(key, weights=df['Amount'].to_numpy(dtype='float64')[keep], minlength=n_months * n_groups).reshape(n_months, n_groups)
+    count = np.bincount(key, minlength=n_months * n_groups).reshape(n_months, n_groups)
+
+    # Keep only the months and groups that actually occur
+    rows, cols = count.any(axis=1), count.any(axis=0)
+    index = pd.Index(np.arange(first_month, first_month + n_months)[rows], name='_yearmonth')
+    columns = pd.Index(groups[cols], name=group_col)
+    return pd.concat({
+        'total': pd.DataFrame(total[rows][:, cols], index=index, columns=columns),
+        'count': pd.DataFrame(count[rows][:, cols], index=index, columns=columns)
+    }, axis=1)
+
+@st.cache_data(show_spinner=False)
+def unique_sorted(_df, df_key, col, filter_col=None, filter_vals=()):
+    """
+    Returns the sorted unique values of a column, used as filter options.
+    If filter_vals is given, only rows where filter_col is in filter_vals are considered.
+    The cache is shared by every page, so df_key must identify _df app-wide.
+    """
+    values = _df[col]
+    if filter_col is not None and filter_vals:
+        values = values[isin_mask(_df[filter_col], filter_vals)]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # The categories that occur, read off the codes without boxing a label per row
+        codes = values.cat.codes.to_numpy()
+        return sorted(values.cat.categories[np.unique(codes[codes >= 0])])
+    return sorted(values.unique())
+
+def percent_change(current, baseline):
+    """
+    Returns the % change from baseline to current per element, or inf where there is no positive baseline.
+    The denominator is swapped for 1 where baseline <= 0, so no division by zero happens.
+    """
+    has_baseline = baseline > 0
+    return np.where(has_baseline, (current - baseline) / np.where(has_baseline, baseline, 1) * 100, np.inf)
+
+@st.cache_resource(show_spinner=False)
+def get_color_map(groups):
+    """
+    Returns a {group: color} dict for a sorted tuple of groups.
+    Built from the unfiltered groups so colors stay put when filters change.
+    """
+    color_sequence = px.colors.qualitative.Plotly + px.colors.qualitative.G10 + px.colors.qualitative.Alphabet
+    return {group: color_sequence[i % len(color_sequence)] for i, group in enumerate(groups)}
+
+# Rows sent to a transaction table by default; table_row_limit lets the user ask for more
+DEFAULT_TABLE_ROWS = 500
+
+def table_row_limit(n_rows, key):
+    """
+    Shows the row controls for a transaction table with n_rows rows and returns how many of the
+    most recent rows to send: DEFAULT_TABLE_ROWS by default, more with the slider, or all of them
+    with the 'Show all' checkbox. key prefixes the widget keys so each table keeps its own setting.
+    """
+    if n_rows <= DEFAULT_TABLE_ROWS:
+        return n_rows
+    if st.checkbox(f"Show all {n_rows:,} transactions", key=f"{key}_show_all"):
+        return n_rows
+    # The slider moves in steps of 100, so its end is rounded up to the next step to reach every row
+    max_rows = -(-n_rows // 100) * 100
+    rows_to_show = min(st.slider("Rows to show", min_value=100, max_value=max_rows, value=DEFAULT_TABLE_ROWS, step=100, key=f"{key}_rows"), n_rows)
+    st.caption(f"Showing the latest {rows_to_show:,} of {n_rows:,} transactions.")
+    return rows_to_show
+
+@lru_cache(maxsize=16)
+def _resolve_date_range(option, today, min_date, max_date):
+    """
+    Returns the (start_date, end_date) of a preset date range option ("Custom" is read from the date input).
+    """
+    if option == "This Week":
+        return today - timedelta(days=today.weekday()), today
+    if option == "This Month":
+        return today.replace(day=1), today
+    if option == "Last 30 Days":
+        return today - timedelta(days=30), today
+    if option == "This Quarter":
+        quarter_start_month = (today.month - 1) // 3 * 3 + 1
+        return today.replace(month=quarter_start_month, day=1), today
+    if option == "Year to Date":
+        return today.replace(month=1, day=1), today
+    # All Time
+    return min_date, max_date
 
 def display_global_date_filter():
     """
@@ -28,13 +271,11 @@ def display_global_date_filter():
     Saves the selected start and end dates to session_state.
     """
     if "processed_data" in st.session_state and not st.session_state.processed_data.empty:
-        df = st.session_state.processed_data
         st.sidebar.markdown("---")
         st.sidebar.header("🗓️ Global Date Filter")
         
         try:
-            min_date = df['Date'].min().date()
-            max_date = df['Date'].max().date()
+            min_date, max_date = get_date_bounds()
 
             if min_date > max_date:
                 st.sidebar.error("Warning: Your data's minimum date is after the maximum date. Please check your data.")
@@ -61,25 +302,8 @@ def display_global_date_filter():
             index=date_options.index(st.session_state.get("global_date_option", "All Time"))
         )
 
-        if selected_option == "This Week":
-            start_date = today - timedelta(days=today.weekday())
-            end_date = today
-        elif selected_option == "This Month":
-            start_date = today.replace(day=1)
-            end_date = today
-        elif selected_option == "Last 30 Days":
-            start_date = today - timedelta(days=30)
-            end_date = today
-        elif selected_option == "This Quarter":
-            quarter_start_month = (today.month - 1) // 3 * 3 + 1
-            start_date = today.replace(month=quarter_start_month, day=1)
-            end_date = today
-        elif selected_option == "Year to Date":
-            start_date = today.replace(month=1, day=1)
-            end_date = today
-        elif selected_option == "All Time":
-            start_date = min_date
-            end_date = max_date
+        if selected_option != "Custom":
+            start_date, end_date = _resolve_date_range(selected_option, today, min_date, max_date)
         else: # Custom
             # Use persistent dates if available, else default to min/max
             default_start = st.session_state.get("global_start_date", min_date)